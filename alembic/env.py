@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 # and import your models so Alembic sees them for autogenerate
 from database import Base, engine
 from models import User  # Or other models if you have them
+from migrations import MIGRATION_LOCK_TIMEOUT
 
 # This Alembic Config object provides access to values within the .ini file in use.
 config = context.config
@@ -46,8 +47,12 @@ def run_migrations_offline() -> None:
         literal_binds=True,
         compare_type=True,  # So Alembic detects column type changes
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
+    if url.startswith("postgresql"):
+        context.execute(f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+
     with context.begin_transaction():
         context.run_migrations()
 
@@ -58,14 +63,25 @@ def run_migrations_online() -> None:
 
     In this scenario, we create an Engine from our existing 'database.py' code
     (i.e., the already-imported 'engine'), then associate a connection with the context.
+
+    Each migration commits on its own, so one that builds an index
+    concurrently or backfills in batches (see migrations.py) doesn't hold the
+    locks of the migrations before it. DDL that can't get its lock within
+    MIGRATION_LOCK_TIMEOUT fails rather than blocking the bot's queries.
     """
     connectable = engine  # Use the engine you imported from 'database.py'
 
     with connectable.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # Session-wide, so it also applies outside the per-migration transactions
+            connection.exec_driver_sql(f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
-            compare_type=True  # So Alembic checks for type diffs
+            compare_type=True,  # So Alembic checks for type diffs
+            transaction_per_migration=True,
         )
 
         with context.begin_transaction():
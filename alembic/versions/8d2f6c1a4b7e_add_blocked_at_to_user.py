@@ -0,0 +1,35 @@
+"""Add blocked_at to User
+
+Revision ID: 8d2f6c1a4b7e
+Revises: ef5795904cae
+Create Date: 2026-10-17 10:02:11.418236
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6c1a4b7e'
+down_revision = 'ef5795904cae'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('blocked_at', sa.DateTime(), nullable=True))
+    # Partial index covering only reachable users, used for broadcast keyset scans (created_at for signup windows)
+    create_index_concurrently(
+        'ix_users_reachable_id',
+        'users',
+        ['id'],
+        unique=False,
+        postgresql_include=['telegram_user_id', 'created_at'],
+        postgresql_where=sa.text('blocked_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_users_reachable_id', 'users')
+    op.drop_column('users', 'blocked_at')
@@ -0,0 +1,31 @@
+"""Create media_files table
+
+Revision ID: a41c9e7d2f05
+Revises: 8d2f6c1a4b7e
+Create Date: 2026-10-17 11:24:37.902145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c9e7d2f05'
+down_revision = '8d2f6c1a4b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('media_files',
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('media_type', sa.String(), nullable=False),
+    sa.Column('file_id', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('content_hash')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('media_files')
@@ -0,0 +1,26 @@
+"""Add broadcast schedule and delivery window
+
+Revision ID: a6d3e8f1c250
+Revises: d4a92c6e8b17
+Create Date: 2026-10-18 01:12:40.518377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3e8f1c250'
+down_revision = 'd4a92c6e8b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('broadcasts', sa.Column('scheduled_at', sa.DateTime(), nullable=True))
+    op.add_column('broadcasts', sa.Column('delivery_window', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'delivery_window')
+    op.drop_column('broadcasts', 'scheduled_at')
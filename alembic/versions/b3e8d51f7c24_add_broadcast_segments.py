@@ -0,0 +1,45 @@
+"""Add broadcast segments
+
+Revision ID: b3e8d51f7c24
+Revises: f9b1d4e6a283
+Create Date: 2026-10-17 19:05:27.318409
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e8d51f7c24'
+down_revision = 'f9b1d4e6a283'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('broadcasts', sa.Column('segment', sa.JSON(), nullable=True))
+    # Keyset scans over one referral campaign's reachable users
+    create_index_concurrently(
+        'ix_users_reachable_ref_id',
+        'users',
+        ['first_start_param', 'id'],
+        unique=False,
+        postgresql_include=['telegram_user_id', 'created_at'],
+        postgresql_where=sa.text('blocked_at IS NULL'),
+    )
+    # Count and users.id range of a signup window's reachable users
+    create_index_concurrently(
+        'ix_users_reachable_created_at_id',
+        'users',
+        ['created_at', 'id'],
+        unique=False,
+        postgresql_include=['telegram_user_id'],
+        postgresql_where=sa.text('blocked_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_users_reachable_created_at_id', 'users')
+    drop_index_concurrently('ix_users_reachable_ref_id', 'users')
+    op.drop_column('broadcasts', 'segment')
@@ -0,0 +1,31 @@
+"""Add users.blocked_at index
+
+Revision ID: b8f4c2d7e391
+Revises: a6d3e8f1c250
+Create Date: 2026-10-18 10:24:05.731904
+
+"""
+import sqlalchemy as sa
+from migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f4c2d7e391'
+down_revision = 'a6d3e8f1c250'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Only the unreachable users, so it stays small
+    create_index_concurrently(
+        'ix_users_blocked_at',
+        'users',
+        ['blocked_at'],
+        unique=False,
+        postgresql_where=sa.text('blocked_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_users_blocked_at', 'users')
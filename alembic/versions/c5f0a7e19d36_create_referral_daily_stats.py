@@ -0,0 +1,51 @@
+"""Create referral_daily_stats rollup
+
+Revision ID: c5f0a7e19d36
+Revises: b3e8d51f7c24
+Create Date: 2026-10-17 21:40:09.126733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from migrations import backfill
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f0a7e19d36'
+down_revision = 'b3e8d51f7c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('referral_daily_stats',
+    sa.Column('code', sa.String(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('users', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('code', 'day')
+    )
+    # The table is new and empty, so a plain build doesn't block anyone
+    op.create_index('ix_referral_daily_stats_day_code', 'referral_daily_stats', ['day', 'code'], unique=False,
+                    postgresql_include=['users'])
+
+    # Backfill from the existing users; from now on registration keeps it up to date.
+    # In users.id batches, so concurrent signups wait on a rollup row for one batch at most
+    day = "date(created_at)" if op.get_context().dialect.name == "sqlite" else "CAST(created_at AS DATE)"
+    try:
+        backfill(
+            "INSERT INTO referral_daily_stats (code, day, users) "
+            f"SELECT COALESCE(first_start_param, ''), {day}, COUNT(*) FROM users "
+            "WHERE id > :start AND id <= :end "
+            f"GROUP BY COALESCE(first_start_param, ''), {day} "
+            "ON CONFLICT (code, day) DO UPDATE SET users = referral_daily_stats.users + excluded.users",
+            'users',
+        )
+    except Exception:
+        # The table and the batches done so far are already committed; drop them so a rerun starts over
+        with op.get_context().autocommit_block():
+            op.drop_table('referral_daily_stats')
+        raise
+
+
+def downgrade() -> None:
+    op.drop_table('referral_daily_stats')
@@ -0,0 +1,39 @@
+"""Create broadcasts table
+
+Revision ID: c7e3b5a90d12
+Revises: a41c9e7d2f05
+Create Date: 2026-10-17 13:05:52.611370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e3b5a90d12'
+down_revision = 'a41c9e7d2f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('broadcasts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('admin_chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('status', sa.String(), server_default='running', nullable=False),
+    sa.Column('text', sa.Text(), nullable=True),
+    sa.Column('photo', sa.String(), nullable=True),
+    sa.Column('buttons', sa.JSON(), nullable=False),
+    sa.Column('total', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('cursor_id', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('sent', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('broadcasts')
@@ -0,0 +1,38 @@
+"""Add broadcast_deliveries and live progress columns
+
+Revision ID: d4a92c6e8b17
+Revises: c5f0a7e19d36
+Create Date: 2026-10-17 23:18:52.604197
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a92c6e8b17'
+down_revision = 'c5f0a7e19d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('broadcast_deliveries',
+    sa.Column('broadcast_id', sa.Integer(), nullable=False),
+    sa.Column('telegram_user_id', sa.BigInteger(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['broadcast_id'], ['broadcasts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('broadcast_id', 'telegram_user_id')
+    )
+    op.add_column('broadcasts', sa.Column('progress_message_id', sa.BigInteger(), nullable=True))
+    op.add_column('broadcasts', sa.Column('progress_done', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('broadcasts', sa.Column('started_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('broadcasts', 'started_at')
+    op.drop_column('broadcasts', 'progress_done')
+    op.drop_column('broadcasts', 'progress_message_id')
+    op.drop_table('broadcast_deliveries')
@@ -0,0 +1,53 @@
+"""Add broadcast_chunks and replicas
+
+Revision ID: e52a8f3c6b91
+Revises: c7e3b5a90d12
+Create Date: 2026-10-17 14:48:09.137522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e52a8f3c6b91'
+down_revision = 'c7e3b5a90d12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('broadcast_chunks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('broadcast_id', sa.Integer(), nullable=False),
+    sa.Column('start_id', sa.Integer(), nullable=False),
+    sa.Column('end_id', sa.Integer(), nullable=False),
+    sa.Column('cursor_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), server_default='pending', nullable=False),
+    sa.Column('owner', sa.String(), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('sent', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['broadcast_id'], ['broadcasts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_broadcast_chunks_broadcast_id'), 'broadcast_chunks', ['broadcast_id'], unique=False)
+    op.create_index('ix_broadcast_chunks_status_id', 'broadcast_chunks', ['status', 'id'], unique=False)
+    op.create_table('replicas',
+    sa.Column('replica_id', sa.String(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('replica_id')
+    )
+    op.add_column('broadcasts', sa.Column('progress_reported_at', sa.DateTime(), nullable=True))
+    # Progress now lives on the chunks
+    op.drop_column('broadcasts', 'cursor_id')
+
+
+def downgrade() -> None:
+    op.add_column('broadcasts', sa.Column('cursor_id', sa.Integer(), server_default='0', nullable=False))
+    op.drop_column('broadcasts', 'progress_reported_at')
+    op.drop_table('replicas')
+    op.drop_index('ix_broadcast_chunks_status_id', table_name='broadcast_chunks')
+    op.drop_index(op.f('ix_broadcast_chunks_broadcast_id'), table_name='broadcast_chunks')
+    op.drop_table('broadcast_chunks')
@@ -0,0 +1,30 @@
+"""Create processed_updates table
+
+Revision ID: f9b1d4e6a283
+Revises: e52a8f3c6b91
+Create Date: 2026-10-17 16:12:40.550871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f9b1d4e6a283'
+down_revision = 'e52a8f3c6b91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('processed_updates',
+    sa.Column('update_id', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('update_id')
+    )
+    op.create_index(op.f('ix_processed_updates_created_at'), 'processed_updates', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_processed_updates_created_at'), table_name='processed_updates')
+    op.drop_table('processed_updates')
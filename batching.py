@@ -0,0 +1,47 @@
+# batching.py
+
+import asyncio
+
+
+class BatchWriter:
+    """
+    Collects items and writes them in one go every `interval` seconds, or as
+    soon as `max_batch` have accumulated, instead of one write per item.
+    With a zero interval every item is written on its own.
+
+    Subclasses queue items with `put()` and implement `write(batch)`, which
+    runs as a background task and should handle its own errors.
+    """
+
+    def __init__(self, interval, max_batch):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending = {}  # key -> item; a later put() with the same key replaces the item
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes = set()
+
+    def put(self, key, item):
+        self._pending[key] = item
+        if self.interval <= 0 or len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = list(self._pending.values()), {}
+        if batch:
+            task = asyncio.create_task(self.write(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def write(self, batch):
+        raise NotImplementedError
+
+    async def close(self):
+        """Write what is pending and wait for every write in progress."""
+        self.flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
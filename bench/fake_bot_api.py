@@ -0,0 +1,170 @@
+# bench/fake_bot_api.py
+#
+# Stand-in for api.telegram.org used by the load tests: answers the Bot API
+# methods bot.py calls, with configurable latency and injected 429/403 errors.
+#
+#   python bench/fake_bot_api.py --port 8081 --latency 0.05 --retry-after-rate 0.01
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendAnimation"}
+
+
+class FakeBotApi:
+    """Bot API behaviour plus the bookkeeping the load generator reads back from /bench/stats."""
+
+    def __init__(self, latency=0.05, jitter=0.5, retry_after_rate=0.0, retry_after=1, forbidden_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.webhook_url = None
+        self.animations = {}  # chat_id -> wall-clock time of the first delivered animation
+        self.blocked = set()  # chats whose animation was answered with an injected 403
+        self._message_id = 0
+        self._file_id = 0
+
+    def stats(self):
+        return {
+            "calls": dict(self.calls),
+            "webhook_url": self.webhook_url,
+            "animations": self.animations,
+            "blocked": list(self.blocked),
+        }
+
+    async def call(self, method, params):
+        """Returns (HTTP status, Bot API response body)."""
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+        if method in SEND_METHODS:
+            roll = random.random()
+            if roll < self.retry_after_rate:
+                self.calls[f"{method}:429"] += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            if roll < self.retry_after_rate + self.forbidden_rate:
+                self.calls[f"{method}:403"] += 1
+                if method == "sendAnimation":
+                    self.blocked.add(params["chat_id"])
+                return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+
+        self.calls[method] += 1
+        handler = getattr(self, f"_{method}", None)
+        result = handler(params) if handler else True
+        return 200, {"ok": True, "result": result}
+
+    def _getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+    def _setWebhook(self, params):
+        self.webhook_url = params.get("url")
+        return True
+
+    def _getWebhookInfo(self, params):
+        return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+
+    def _message(self, params, **content):
+        self._message_id += 1
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **content,
+        }
+
+    def _new_file(self):
+        self._file_id += 1
+        return {"file_id": f"bench-file-{self._file_id}", "file_unique_id": f"bench-{self._file_id}"}
+
+    def _sendMessage(self, params):
+        return self._message(params, text=params.get("text", ""))
+
+    def _editMessageText(self, params):
+        return self._message(params, text=params.get("text", ""))
+
+    def _sendPhoto(self, params):
+        photo = params.get("photo")
+        file = {"file_id": photo} if isinstance(photo, str) else self._new_file()
+        return self._message(params, photo=[{"file_unique_id": "bench", **file, "width": 640, "height": 640}])
+
+    def _sendAnimation(self, params):
+        self.animations.setdefault(params["chat_id"], time.time())
+        animation = params.get("animation")
+        file = {"file_id": animation} if isinstance(animation, str) else self._new_file()
+        return self._message(params, animation={
+            "file_unique_id": "bench", **file, "width": 320, "height": 320, "duration": 3,
+        })
+
+
+class MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, method):
+        params = {name: self.get_body_argument(name) for name in self.request.body_arguments}
+        for name in self.request.files:
+            params[name] = self.request.files[name][0]
+        status, response = await self.api.call(method, params)
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(response))
+
+    get = post
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    def get(self):
+        self.write(self.api.stats())
+
+    def delete(self):
+        self.api.reset()
+
+
+def make_app(api):
+    return tornado.web.Application([
+        (r"/bot[^/]+/(\w+)", MethodHandler, {"api": api}),
+        (r"/bench/stats", StatsHandler, {"api": api}),
+    ])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server for load tests.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds per API call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by +/- this fraction")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after seconds in injected 429s")
+    parser.add_argument("--forbidden-rate", type=float, default=0.0, help="share of sends answered with 403")
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.latency, args.jitter, args.retry_after_rate, args.retry_after, args.forbidden_rate)
+    server = HTTPServer(make_app(api))
+    server.listen(args.port, "127.0.0.1")
+    print(f"Fake Bot API listening on http://127.0.0.1:{args.port}", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,22 +1,30 @@
 import os
 import logging
-import sys
-import json
-import time
-from asyncio import Queue, sleep, create_task, Task
+import tempfile
+from datetime import datetime, timezone
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, ContextTypes, ExtBot, MessageHandler, TypeHandler, filters
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from database import SessionLocal
-from models import User
-
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+from broadcasts import BroadcastManager, BroadcastPayload, describe_schedule, parse_schedule
+from cache import TTLCache
+from coordination import REPLICA_HEARTBEAT_INTERVAL, ReplicaCoordinator
+from database import db_executor, safe_db_query
+from logs import events, setup_logging
+from dedup import UpdateDeduplicator
+from media import MediaCache
+from metrics import Counter, Gauge, Histogram, start_metrics_server
+from ordering import ChatOrderedApplication
+from registration import registrations
+from recipients import UnreachableTracker, count_recipients, describe_segment, parse_segment
+from scheduler import BULK, INTERACTIVE, PriorityScheduler
+from sender import RateLimitedSender, is_unreachable
+from stats import NO_REFERRAL, referral_daily, referral_totals
+from transfer import export_users, import_users, open_dump
+from transport import KeepAliveHTTPXRequest
+
+# Logging setup: records are written to stdout by a background thread (LOG_LEVEL, LOG_FORMAT=text|json)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -27,99 +35,89 @@ ADMIN_USERS = [int(x.strip()) for x in os.getenv('ADMIN_USERS', '').split(',') i
 WEBHOOK_PATH = os.getenv('WEBHOOK_PATH')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL')
 PORT = int(os.getenv('PORT', '8443'))
-
-# Priority Queues
-user_message_queue = Queue()
-broadcast_message_queue = Queue()
-message_worker_task: Task | None = None
-
-# Animation file_id cache
-ANIMATION_CACHE_PATH = "animation_cache.json"
-ANIMATION_FILE_ID = None
-
-def load_animation_file_id():
-    """Load the animation file_id from the cache file."""
-    global ANIMATION_FILE_ID
-    if os.path.isfile(ANIMATION_CACHE_PATH):
-        try:
-            with open(ANIMATION_CACHE_PATH, 'r') as cache_file:
-                data = json.load(cache_file)
-                ANIMATION_FILE_ID = data.get("file_id")
-                logger.info(f"Loaded cached animation file_id: {ANIMATION_FILE_ID}")
-        except Exception as e:
-            logger.error(f"Error loading animation cache: {e}")
+BOT_API_URL = os.getenv('BOT_API_URL')  # e.g. a local Bot API server; defaults to https://api.telegram.org
+SEND_RATE = float(os.getenv('SEND_RATE', '30'))
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', '16'))
+INTERACTIVE_WORKERS = int(os.getenv('INTERACTIVE_WORKERS', '2'))
+INTERACTIVE_QUEUE_SIZE = int(os.getenv('INTERACTIVE_QUEUE_SIZE', '1000'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '100000'))
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '3600'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '8000'))  # 0 disables the /metrics endpoint
+# Separate Bot API connection pools: replies to users, and broadcast sends
+INTERACTIVE_POOL_SIZE = int(os.getenv('INTERACTIVE_POOL_SIZE', '8'))
+INTERACTIVE_TIMEOUT = float(os.getenv('INTERACTIVE_TIMEOUT', '5'))
+BULK_POOL_SIZE = int(os.getenv('BULK_POOL_SIZE', str(SEND_CONCURRENCY)))
+BULK_TIMEOUT = float(os.getenv('BULK_TIMEOUT', '15'))
+BULK_KEEPALIVE = float(os.getenv('BULK_KEEPALIVE', '60'))
+
+# Recently registered profiles: telegram_user_id -> (username, first_name, last_name)
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+# Global token bucket + per-chat limits shared by all outgoing messages
+sender = RateLimitedSender(rate=SEND_RATE)
+
+# Users who blocked the bot or deleted their account, marked in the database in batches
+unreachable_users = UnreachableTracker()
+
+def handle_send_failure(chat_id, error):
+    """Called by the scheduler for sends that failed after all retries."""
+    if is_unreachable(error):
+        events.count("send_unreachable", "User %s is unreachable: %s", chat_id, error)
+        unreachable_users.add(chat_id)
+        # Make sure their next /start reaches the database and reactivates them
+        profile_cache.pop(chat_id)
     else:
-        logger.info("No animation cache found. Will upload animation on first use.")
-
-def save_animation_file_id(file_id):
-    """Save the animation file_id to the cache file."""
-    global ANIMATION_FILE_ID
-    ANIMATION_FILE_ID = file_id
-    try:
-        with open(ANIMATION_CACHE_PATH, 'w') as cache_file:
-            json.dump({"file_id": file_id}, cache_file)
-            logger.info(f"Saved animation file_id to cache: {file_id}")
-    except Exception as e:
-        logger.error(f"Error saving animation cache: {e}")
-
-# Load animation file_id on bot startup
-load_animation_file_id()
-
-def safe_db_query(query_function, retries=3, delay=5):
-    """Safely execute a database query with retries for transient errors."""
-    for attempt in range(retries):
-        try:
-            db = SessionLocal()
-            result = query_function(db)
-            db.close()
-            return result
-        except Exception as e:
-            logger.error(f"Database error on attempt {attempt + 1}: {e}")
-            time.sleep(delay)
-    logger.error("All retries failed. Database query unsuccessful.")
-    return None
-
-async def message_worker():
-    global message_worker_task
-    logger.info("Message worker started.")
-    while not user_message_queue.empty() or not broadcast_message_queue.empty():
-        try:
-            task = None
-            if not user_message_queue.empty():
-                task = await user_message_queue.get()
-                logger.info("Processing user message task.")
-            elif not broadcast_message_queue.empty():
-                task = await broadcast_message_queue.get()
-                logger.info("Processing broadcast message task.")
-
-            if task:
-                logger.info("Executing task...")
-                await task()
-                logger.info("Task executed successfully.")
-        except Exception as e:
-            logger.error(f"Error processing task: {e}")
-        finally:
-            if task and not user_message_queue.empty():
-                user_message_queue.task_done()
-            elif task:
-                broadcast_message_queue.task_done()
-
-        # Add a log to see which tasks were completed
-        logger.info(f"Remaining tasks in queue: {broadcast_message_queue.qsize()} (broadcast), {user_message_queue.qsize()} (user)")
-        await sleep(0.034)
-
-    logger.info("Message worker finished.")
-    message_worker_task = None
-
-async def ensure_message_worker():
-    global message_worker_task
-    if message_worker_task is None or message_worker_task.done():
-        message_worker_task = create_task(message_worker())
+        events.count("send_failed", "Error sending message to %s: %s", chat_id, error, level=logging.ERROR)
+
+# Priority scheduler: interactive replies before broadcast sends, bounded interactive queue
+scheduler = PriorityScheduler(
+    sender,
+    workers=SEND_CONCURRENCY,
+    reserved_workers=INTERACTIVE_WORKERS,
+    interactive_capacity=INTERACTIVE_QUEUE_SIZE,
+    on_failure=handle_send_failure,
+)
 
+# Heartbeats between the replicas; SEND_RATE is the bot's global budget, split between them
+coordinator = ReplicaCoordinator(sender, SEND_RATE)
+
+# Durable broadcast jobs, split into chunks that all replicas claim and checkpoint
+broadcasts = BroadcastManager(scheduler, coordinator.replica_id)
+
+# Recently handled update_ids, so Telegram's webhook retries aren't processed twice
+deduplicator = UpdateDeduplicator()
+
+# Shared file_id cache for uploaded media (the welcome animation and any other assets)
+media_cache = MediaCache()
+
+# Prometheus metrics for the hot paths; collected from the objects above at scrape time
+HANDLER_SECONDS = Histogram("handler_seconds", "Time spent in update handlers.", ["handler"])
+Gauge("scheduler_queue_depth", "Messages waiting in each scheduler lane.", ["lane"],
+      function=lambda: {(lane,): scheduler.depth(lane) for lane in (INTERACTIVE, BULK)})
+Gauge("send_rate_limit", "Current send budget in messages per second, after flood-control throttling.",
+      function=lambda: sender.bucket.rate)
+Counter("cache_hits_total", "Cache lookups that were served from memory.", ["cache"],
+        function=lambda: {("profile",): profile_cache.hits, ("media",): media_cache.hits})
+Counter("cache_misses_total", "Cache lookups that fell through to the database or an upload.", ["cache"],
+        function=lambda: {("profile",): profile_cache.misses, ("media",): media_cache.misses})
+Counter("duplicate_updates_total", "Webhook updates dropped as duplicates.",
+        function=lambda: deduplicator.duplicates)
+metrics_server = None
+
+# Bot with its own connection pool for broadcast sends, created in main()
+bulk_bot = None
+
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs before every other handler and stops updates that were already processed."""
+    if await deduplicator.is_duplicate(update.update_id):
+        events.count("update_duplicate", "Dropping duplicate update %s", update.update_id)
+        raise ApplicationHandlerStop
+
+@HANDLER_SECONDS.time(handler="start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /start command and registers users in the database."""
-    global ANIMATION_FILE_ID
-    logger.info(f"/start command received from {update.effective_user.id}")
+    events.count("start")
     try:
         if update.effective_chat.type == 'private':
             user_id = update.effective_user.id
@@ -128,31 +126,25 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             last_name = update.effective_user.last_name or "Unknown"
             referral_code = context.args[0] if context.args else None
 
-            # Database operation
-            def query_function(db):
-                user = db.query(User).filter(User.telegram_user_id == user_id).first()
-                if not user:
-                    user = User(
-                        telegram_user_id=user_id,
-                        username=username,
-                        first_name=first_name,
-                        last_name=last_name,
-                        first_start_param=referral_code if referral_code else None
-                    )
-                    db.add(user)
-                    db.commit()
-                    logger.info(f"New user registered: {user_id}, param={referral_code}")
-                else:
-                    logger.info(f"Existing user accessed: {user_id}")
-                    if user.username != username or user.first_name != first_name or user.last_name != last_name:
-                        user.username = username
-                        user.first_name = first_name
-                        user.last_name = last_name
-                        db.commit()
-                        logger.info(f"Updated user information: {user_id}")
-                return user
-
-            safe_db_query(query_function)
+            # Repeat visits with an unchanged profile don't need the database at all
+            profile = (username, first_name, last_name)
+            if profile_cache.get(user_id) == profile:
+                events.count("start_cached")
+            else:
+                # Single-statement upsert; in write-behind mode it is batched with other /starts
+                registration = registrations.submit({
+                    "telegram_user_id": user_id,
+                    "username": username,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "first_start_param": referral_code if referral_code else None,
+                })
+                registration.add_done_callback(
+                    lambda result: not result.cancelled() and result.result() is not None
+                    and profile_cache.set(user_id, profile)
+                )
+                if not registrations.write_behind:
+                    await registration
 
             open_app_url = f"https://t.me/CoinbeatsMiniApp_bot/miniapp"
             if referral_code:
@@ -175,38 +167,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 "Start learning and earning daily rewards! 🚀🚀"
             )
 
-            # Use cached file_id if available
-            if ANIMATION_FILE_ID:
-                try:
-                    await user_message_queue.put(lambda: context.bot.send_animation(
-                        chat_id=update.effective_chat.id,
-                        animation=ANIMATION_FILE_ID,
-                        caption=welcome_message,
-                        reply_markup=reply_markup
-                    ))
-                except Exception as e:
-                    logger.warning("Cached animation file_id is invalid. Re-uploading animation.")
-                    with open(MEDIA_PATH, 'rb') as animation_file:
-                        message = await context.bot.send_animation(
-                            chat_id=update.effective_chat.id,
-                            animation=animation_file,
-                            caption=welcome_message,
-                            reply_markup=reply_markup
-                        )
-                        save_animation_file_id(message.animation.file_id)
-            else:
-                with open(MEDIA_PATH, 'rb') as animation_file:
-                    message = await context.bot.send_animation(
-                        chat_id=update.effective_chat.id,
-                        animation=animation_file,
-                        caption=welcome_message,
-                        reply_markup=reply_markup
-                    )
-                    save_animation_file_id(message.animation.file_id)
-
-            await ensure_message_worker()
+            # Sent with the cached file_id; the first send of a new asset uploads it once
+            chat_id = update.effective_chat.id
+            await scheduler.submit(chat_id, lambda: media_cache.send_animation(
+                context.bot,
+                chat_id,
+                MEDIA_PATH,
+                caption=welcome_message,
+                reply_markup=reply_markup
+            ))
     except Exception as e:
-        logger.error(f"Error in /start: {e}")
+        logger.exception("Error in /start: %s", e)
 
         # Define a custom filter for the broadcast command
 class BroadcastFilter(filters.MessageFilter):
@@ -216,14 +187,20 @@ class BroadcastFilter(filters.MessageFilter):
 
 broadcast_filter = BroadcastFilter()
 
+@HANDLER_SECONDS.time(handler="broadcast")
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles /broadcast to send a message or photo to all users."""
+    """
+    Handles /broadcast to send a message or photo to all users, or to a
+    segment: `/broadcast ref=<code> since=<date> until=<date> text || button,url`.
+    After the segment filters, `at=<time>` schedules it (UTC unless the time
+    has an offset) and `over=<duration>` (e.g. 2h) spreads the sends evenly
+    over that window. The admin confirms the recipient count before anything
+    is sent.
+    """
     if update.effective_user.id not in ADMIN_USERS:
         await update.message.reply_text("You are not authorized to use this command.")
         return
 
-    logger.info("Starting broadcast function...")
-
     # Extract text and photo from the message
     message_text = None
     if update.message.text and update.message.text.startswith('/broadcast'):
@@ -233,11 +210,15 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     photo = update.message.photo[-1].file_id if update.message.photo else None
 
-    logger.info(f"Broadcast text: {message_text}")
-    if photo:
-        logger.info(f"Broadcast photo detected with File ID: {photo}")
-    else:
-        logger.info("No photo detected in the broadcast message.")
+    try:
+        segment, message_text = parse_segment(message_text)
+        scheduled_at, delivery_window, message_text = parse_schedule(message_text)
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid broadcast option: {e}")
+        return
+
+    logger.info("Broadcast requested by %s (%d characters, photo: %s)",
+                update.effective_user.id, len(message_text or ''), photo or 'none')
 
     if not message_text and not photo:
         await update.message.reply_text("Please provide a message or image to broadcast.")
@@ -251,60 +232,249 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     for part in parts[1:]:
         if ',' in part:
             btn_text, btn_url = part.strip().split(',', 1)
-            buttons.append([InlineKeyboardButton(btn_text.strip(), url=btn_url.strip())])
+            buttons.append((btn_text.strip(), btn_url.strip()))
 
-    default_button = [InlineKeyboardButton("🚀 Open App", url="https://t.me/CoinbeatsMiniApp_bot/miniapp")]
+    default_button = ("🚀 Open App", "https://t.me/CoinbeatsMiniApp_bot/miniapp")
     buttons.append(default_button)
-    reply_markup = InlineKeyboardMarkup(buttons) if buttons else None
 
-    logger.info("Loading users from the database...")
-    users = safe_db_query(lambda db: [user.telegram_user_id for user in db.query(User).all()])
-    if not users:
-        logger.warning("No users found in the database for broadcasting.")
-        await update.message.reply_text("No users found to broadcast the message.")
+    total = await safe_db_query(lambda db: count_recipients(db, segment=segment))
+    if not total:
+        logger.warning("No users found for broadcasting to %s.", describe_segment(segment))
+        await update.message.reply_text(f"No users found to broadcast the message ({describe_segment(segment)}).")
         return
 
-    logger.info(f"Loaded {len(users)} users from the database.")
-    logger.info(f"User IDs: {users}")
-
-    # Queue messages for broadcasting
-    for user_id in users:
-        logger.info(f"Queuing message for user_id: {user_id}")
-        if photo:
-            logger.info(f"Queuing photo message for user_id: {user_id} with caption: {text}")
-            await broadcast_message_queue.put(lambda user_id=user_id: context.bot.send_photo(
-                chat_id=user_id,
-                photo=photo,
-                caption=text if text else None,
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            ))
+    payload = BroadcastPayload(text, photo, buttons)
+    broadcast_id = await broadcasts.draft(update.effective_chat.id, payload, total, segment, scheduled_at, delivery_window)
+    if broadcast_id is None:
+        await update.message.reply_text("Could not start the broadcast, please try again.")
+        return
+
+    confirmation = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Send", callback_data=f"broadcast:send:{broadcast_id}"),
+        InlineKeyboardButton("❌ Cancel", callback_data=f"broadcast:cancel:{broadcast_id}"),
+    ]])
+    await update.message.reply_text(
+        f"Broadcast #{broadcast_id} will go to {total} users ({describe_segment(segment)}), "
+        f"{describe_schedule(scheduled_at, delivery_window, total, SEND_RATE)}. Send it?",
+        reply_markup=confirmation
+    )
+
+async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles the Send/Cancel buttons under a drafted broadcast."""
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_USERS:
+        await query.answer("You are not authorized to do this.")
+        return
+    await query.answer()
+
+    _, action, broadcast_id = query.data.split(':')
+    broadcast_id = int(broadcast_id)
+    if action == "send":
+        # Recipients are streamed into the job in the background while the first batches are sent
+        confirmed = await broadcasts.confirm(context.bot, broadcast_id, query.message.message_id)
+        if confirmed is None:
+            await query.edit_message_text(f"Broadcast #{broadcast_id} was already started or cancelled.")
+        elif confirmed.status == "scheduled":
+            # Every replica's tick starts due broadcasts too; this just starts it on the minute
+            context.job_queue.run_once(start_scheduled_broadcasts, confirmed.scheduled_at.replace(tzinfo=timezone.utc),
+                                       name=f"broadcast:{broadcast_id}")
+            await query.edit_message_text(
+                f"Broadcast #{broadcast_id} is scheduled for {confirmed.scheduled_at:%Y-%m-%d %H:%M} UTC "
+                f"({confirmed.total} users so far). Progress will be shown here once it starts.",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("❌ Cancel", callback_data=f"broadcast:cancel:{broadcast_id}"),
+                ]])
+            )
         else:
-            logger.info(f"Queuing text message for user_id: {user_id}")
-            await broadcast_message_queue.put(lambda user_id=user_id: context.bot.send_message(
-                chat_id=user_id,
-                text=text,
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            ))
+            await query.edit_message_text(
+                f"Broadcast #{broadcast_id} has been queued for {confirmed.total} users. Progress will be shown here."
+            )
+    elif await broadcasts.cancel(broadcast_id):
+        for job in context.job_queue.get_jobs_by_name(f"broadcast:{broadcast_id}"):
+            job.schedule_removal()
+        await query.edit_message_text(f"Broadcast #{broadcast_id} was cancelled.")
+    else:
+        await query.edit_message_text(f"Broadcast #{broadcast_id} was already started or cancelled.")
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handles /stats: signups per referral code over the last days, from the
+    referral_daily_stats rollup. `/stats <code>` shows one code per day,
+    `days=<n>` changes the window (default 7); `-` stands for no referral code.
+    """
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
 
-    await update.message.reply_text("Broadcast has been queued for all users.")
-    logger.info("Broadcast has been queued for all users.")
+    days, code = 7, None
+    for arg in context.args:
+        if arg.startswith('days=') and arg[5:].isdigit() and int(arg[5:]) > 0:
+            days = int(arg[5:])
+        else:
+            code = arg
+
+    if code is None:
+        rows = await safe_db_query(lambda db: referral_totals(db, days))
+        if rows is None:
+            await update.message.reply_text("Could not load the statistics, please try again.")
+            return
+        lines = [f"{row.code or '-'}: {row.users}" for row in rows] or ["No signups."]
+        await update.message.reply_text(f"Signups by referral code, last {days} days:\n" + "\n".join(lines))
+    else:
+        lookup = NO_REFERRAL if code == '-' else code
+        rows = await safe_db_query(lambda db: referral_daily(db, lookup, days))
+        if rows is None:
+            await update.message.reply_text("Could not load the statistics, please try again.")
+            return
+        lines = [f"{row.day.isoformat()}: {row.users}" for row in rows] or ["No signups."]
+        total = sum(row.users for row in rows)
+        await update.message.reply_text(
+            f"Signups for {code}, last {days} days ({total} total):\n" + "\n".join(lines)
+        )
+
+async def export_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles /export: sends the admin a gzipped CSV of all users, streamed out of the database with COPY."""
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, f"users-{datetime.utcnow():%Y%m%d-%H%M%S}.csv.gz")
+
+        def export(db):
+            with open_dump(path, "w") as dump:
+                return export_users(db, dump)
 
-    # Start the message worker to process the queue
-    await ensure_message_worker()
+        # Not retried: a second attempt would append to the half-written file
+        exported = await safe_db_query(export, retries=1)
+        if exported is None:
+            await update.message.reply_text("The export failed, see the logs.")
+            return
+        logger.info("Exported %d users for %s.", exported, update.effective_user.id)
+
+        with open(path, 'rb') as document:
+            await update.message.reply_document(
+                document=document, caption=f"{exported} users", read_timeout=120, write_timeout=120
+            )
+
+class ImportFilter(filters.MessageFilter):
+    def filter(self, message):
+        return bool(message.document and message.caption and message.caption.startswith('/import'))
+
+import_filter = ImportFilter()
+
+async def import_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles a CSV (or .csv.gz) document captioned /import: merges its rows into the users table."""
+    if update.effective_user.id not in ADMIN_USERS:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+
+    document = update.message.document
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, os.path.basename(document.file_name or "users.csv"))
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+
+        def import_file(db):
+            with open_dump(path, "r") as dump:
+                return import_users(db, dump)
+
+        imported = await safe_db_query(import_file, retries=1)
+    if imported is None:
+        await update.message.reply_text("The import failed, see the logs.")
+        return
+    read, inserted, updated = imported
+    logger.info("Imported %d rows for %s: %d new users, %d updated.", read, update.effective_user.id, inserted, updated)
+    await update.message.reply_text(f"Imported {read} rows: {inserted} new users, {updated} updated.")
+
+async def coordination_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Heartbeat, then claim broadcast chunks (including ones left behind by dead replicas)."""
+    await coordinator.heartbeat()
+    # Users another replica marked unreachable must reach the database on their next /start here too
+    for telegram_user_id in await unreachable_users.poll():
+        profile_cache.pop(telegram_user_id)
+    await broadcasts.tick(context.bot)
+
+async def start_scheduled_broadcasts(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await broadcasts.tick(context.bot)
+
+async def prune_processed_updates(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await deduplicator.prune()
+
+async def post_init(application: Application) -> None:
+    global metrics_server
+    if METRICS_PORT:
+        metrics_server = start_metrics_server(METRICS_PORT)
+    if bulk_bot:
+        await bulk_bot.initialize()
+    await media_cache.warm([MEDIA_PATH])
+    await coordinator.heartbeat()
+    scheduler.start()
+    application.job_queue.run_repeating(coordination_tick, interval=REPLICA_HEARTBEAT_INTERVAL, first=0)
+    application.job_queue.run_repeating(prune_processed_updates, interval=600)
+
+async def post_shutdown(application: Application) -> None:
+    # Broadcasts first, so their in-flight sends finish before the workers are cancelled
+    await broadcasts.stop()
+    await scheduler.stop()
+    await coordinator.leave()
+    await unreachable_users.close()
+    await registrations.close()
+    if bulk_bot:
+        await bulk_bot.shutdown()
+    db_executor.shutdown(wait=False)
+    events.flush()
+    if metrics_server:
+        metrics_server.stop()
 
 def main():
+    global bulk_bot
     logger.info("Starting the bot in webhook mode...")
 
+    api_urls = {}
+    if BOT_API_URL:
+        api_urls = {"base_url": f"{BOT_API_URL}/bot", "base_file_url": f"{BOT_API_URL}/file/bot"}
+
+    # Welcome messages and admin replies: a small pool that fails fast instead of queueing for a connection
+    interactive_request = KeepAliveHTTPXRequest(
+        connection_pool_size=INTERACTIVE_POOL_SIZE,
+        connect_timeout=INTERACTIVE_TIMEOUT,
+        read_timeout=INTERACTIVE_TIMEOUT,
+        write_timeout=INTERACTIVE_TIMEOUT,
+        pool_timeout=1.0,
+    )
+    # Broadcast sends: one connection per worker, kept alive between batches, patient timeouts
+    bulk_bot = ExtBot(BOT_TOKEN, request=KeepAliveHTTPXRequest(
+        connection_pool_size=BULK_POOL_SIZE,
+        keepalive_expiry=BULK_KEEPALIVE,
+        connect_timeout=BULK_TIMEOUT,
+        read_timeout=BULK_TIMEOUT,
+        write_timeout=BULK_TIMEOUT,
+        pool_timeout=BULK_TIMEOUT,
+    ), **api_urls)
+    broadcasts.bulk_bot = bulk_bot
+
+    builder = Application.builder().token(BOT_TOKEN).request(interactive_request)
+    if BOT_API_URL:
+        builder = builder.base_url(api_urls["base_url"]).base_file_url(api_urls["base_file_url"])
+
     application = (
-        Application.builder()
-        .token(BOT_TOKEN)
+        builder
+        # Different chats are handled concurrently, each chat's updates still in order
+        .application_class(ChatOrderedApplication)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
+    application.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(broadcast_filter, broadcast))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("export", export_users_command))
+    application.add_handler(MessageHandler(import_filter, import_users_command))
+    application.add_handler(CallbackQueryHandler(confirm_broadcast, pattern=r"^broadcast:(send|cancel):\d+$"))
 
     application.run_webhook(
         listen="0.0.0.0",
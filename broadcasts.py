@@ -0,0 +1,858 @@
+# broadcasts.py
+
+import asyncio
+import logging
+import os
+import re
+import time
+from array import array
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case, exists, func, or_, select, update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+from batching import BatchWriter
+from database import dialect_insert, safe_db_query
+from models import Broadcast, BroadcastChunk, BroadcastDelivery
+from recipients import RECIPIENT_BATCH_SIZE, count_recipients, fetch_recipient_batch, recipient_id_range
+from sender import is_unreachable
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "5"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+# Delivery outcomes are written to broadcast_deliveries in multi-row inserts this often (or at this size)
+BROADCAST_LEDGER_INTERVAL = float(os.getenv("BROADCAST_LEDGER_INTERVAL", "2"))
+BROADCAST_LEDGER_BATCH_SIZE = int(os.getenv("BROADCAST_LEDGER_BATCH_SIZE", "1000"))
+# Size of the users.id range in one chunk, and how many chunks a replica works on at once
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "10000"))
+BROADCAST_CHUNKS_PER_REPLICA = int(os.getenv("BROADCAST_CHUNKS_PER_REPLICA", "2"))
+# A chunk whose owner hasn't checkpointed for this long is taken over by another replica
+BROADCAST_LEASE_TTL = float(os.getenv("BROADCAST_LEASE_TTL", "30"))
+# On shutdown, how long to wait for sends already handed to the workers before giving up on them
+BROADCAST_DRAIN_TIMEOUT = float(os.getenv("BROADCAST_DRAIN_TIMEOUT", "10"))
+
+# Once this many recipients have been handed out, the consumed prefix is dropped
+COMPACT_THRESHOLD = 65536
+# Granularity of the resume cursor: at most this many recipients (plus those in flight) are re-sent after a crash
+CHECKPOINT_ROWS = 100
+# How often a paced job is handed the recipients it may send next
+PACING_TICK = 0.5
+
+# Leading at=<time> and over=<duration> words of a /broadcast message, after the segment filters
+SCHEDULE_OPTION = re.compile(r"\s*(at|over)=(\S+)")
+DURATION = re.compile(r"(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?")
+
+
+def parse_duration(value):
+    """Seconds in a duration like 90m, 2h or 1h30m; raises ValueError."""
+    match = DURATION.fullmatch(value)
+    if not value or not match:
+        raise ValueError(f"over= must be a duration like 2h or 1h30m, not {value!r}")
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def parse_schedule(text, now=None):
+    """
+    Split at=<ISO time, UTC unless it has an offset> and over=<duration>
+    off the start of a /broadcast message. Returns (scheduled_at as naive
+    UTC or None, delivery window in seconds or None, rest of the text);
+    raises ValueError for a malformed value or a time in the past.
+    """
+    now = now or datetime.utcnow()
+    scheduled_at = window = None
+    while text:
+        match = SCHEDULE_OPTION.match(text)
+        if not match:
+            break
+        key, value = match.groups()
+        if key == "at":
+            try:
+                scheduled_at = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"at= must be a time like 2024-06-01T18:00, not {value!r}")
+            if scheduled_at.tzinfo is not None:
+                scheduled_at = scheduled_at.astimezone(timezone.utc).replace(tzinfo=None)
+            if scheduled_at < now - timedelta(minutes=1):
+                raise ValueError(f"at={value} is in the past")
+        else:
+            window = parse_duration(value) or None
+        text = text[match.end():]
+    return scheduled_at, window, (text or '').strip()
+
+
+class BroadcastPayload:
+    """The message every recipient of a broadcast gets, built once and shared."""
+
+    __slots__ = ("text", "photo", "buttons", "reply_markup", "parse_mode")
+
+    def __init__(self, text, photo=None, buttons=(), parse_mode='HTML'):
+        self.text = text
+        self.photo = photo
+        self.buttons = [[btn_text, btn_url] for btn_text, btn_url in buttons]
+        self.reply_markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(btn_text, url=btn_url)] for btn_text, btn_url in self.buttons]
+        ) if self.buttons else None
+        self.parse_mode = parse_mode
+
+    def send(self, bot, chat_id):
+        if self.photo:
+            return bot.send_photo(
+                chat_id=chat_id,
+                photo=self.photo,
+                caption=self.text if self.text else None,
+                reply_markup=self.reply_markup,
+                parse_mode=self.parse_mode
+            )
+        return bot.send_message(
+            chat_id=chat_id,
+            text=self.text,
+            reply_markup=self.reply_markup,
+            parse_mode=self.parse_mode
+        )
+
+
+class BroadcastJob:
+    """
+    A broadcast in progress: one shared payload, the recipients as a packed
+    array of 64-bit telegram_user_ids and a cursor into it. Recipients can
+    be appended while earlier ones are being sent, and the consumed prefix
+    is dropped as the cursor advances, so memory stays at a few bytes per
+    pending recipient.
+
+    A job covers one chunk of a broadcast: the users.id range
+    (cursor_id, end_id]. Recipients arrive in keyset batches, and `cursor_id`
+    only moves past a group of recipients once every send in it has
+    finished, so it is always safe to resume from.
+    """
+
+    def __init__(self, bot, payload, broadcast_id=None, chunk_id=None, admin_chat_id=None, cursor_id=0, end_id=None,
+                 sent=0, failed=0, segment=None, ledger=None, rate=None):
+        self.bot = bot
+        self.payload = payload
+        self.segment = segment
+        self.ledger = ledger
+        # Recipients per second handed to the senders, for a broadcast with a delivery window; None means no pacing
+        self.rate = rate
+        self.broadcast_id = broadcast_id
+        self.chunk_id = chunk_id
+        self.admin_chat_id = admin_chat_id
+        self.cursor_id = cursor_id
+        self.end_id = end_id
+        self.sent = sent
+        self.failed = failed
+        # Counters as of cursor_id, persisted together with it
+        self.confirmed_sent = sent
+        self.confirmed_failed = failed
+        self.in_flight = 0
+        self.loading = True
+        self.finished = asyncio.Event()
+        self.needs_recipients = asyncio.Event()
+        self.needs_recipients.set()
+        self._recipients = array('q')
+        self._ids = array('q')  # users.id of each recipient in _recipients
+        self._offset = 0  # position of _recipients[0] within the whole job
+        self._cursor = 0
+        self._last_id = None  # users.id of the last recipient handed out
+        self._abandoned = False
+        # [last users.id, end position, unfinished sends, sent, failed] per CHECKPOINT_ROWS recipients
+        self._batches = deque()
+        # (end position, time.monotonic()) per extend(), for the scheduler's queue wait metric
+        self._extended = deque()
+
+    @classmethod
+    def from_chunk(cls, bot, record, chunk, ledger=None):
+        payload = BroadcastPayload(record.text, record.photo, record.buttons)
+        return cls(bot, payload, broadcast_id=record.id, chunk_id=chunk.id, admin_chat_id=record.admin_chat_id,
+                   cursor_id=chunk.cursor_id, end_id=chunk.end_id, sent=chunk.sent, failed=chunk.failed,
+                   segment=record.segment, ledger=ledger,
+                   # Paced jobs wait for their rate from paced_chunk_rates()
+                   rate=0.0 if record.delivery_window else None)
+
+    def extend(self, rows):
+        """Append a keyset batch of (id, telegram_user_id) rows."""
+        if not rows:
+            return
+        self._recipients.extend(row.telegram_user_id for row in rows)
+        self._ids.extend(row.id for row in rows)
+        self._extended.append((self._offset + len(self._recipients), time.monotonic()))
+        end = self._offset + len(self._recipients) - len(rows)
+        for start in range(0, len(rows), CHECKPOINT_ROWS):
+            unit = rows[start:start + CHECKPOINT_ROWS]
+            end += len(unit)
+            self._batches.append([unit[-1].id, end, len(unit), 0, 0])
+        if self.pending >= RECIPIENT_BATCH_SIZE:
+            self.needs_recipients.clear()
+
+    def close(self):
+        """No more recipients will be added."""
+        self.loading = False
+
+    @property
+    def pending(self):
+        return len(self._recipients) - self._cursor
+
+    @property
+    def done(self):
+        return not self.loading and not self.pending and not self.in_flight
+
+    def next_recipient(self):
+        """
+        Hand out the next recipient as (position, chat_id, time it was added
+        to the job), or None when nothing is pending.
+        """
+        if not self.pending:
+            return None
+        position = self._offset + self._cursor
+        chat_id = self._recipients[self._cursor]
+        while self._extended[0][0] <= position:
+            self._extended.popleft()
+        queued_at = self._extended[0][1]
+        self._last_id = self._ids[self._cursor]
+        self._cursor += 1
+        self.in_flight += 1
+        if self._cursor >= COMPACT_THRESHOLD and self._cursor * 2 >= len(self._recipients):
+            del self._recipients[:self._cursor]
+            del self._ids[:self._cursor]
+            self._offset += self._cursor
+            self._cursor = 0
+        if self.pending < RECIPIENT_BATCH_SIZE:
+            self.needs_recipients.set()
+        return position, chat_id, queued_at
+
+    def record(self, position, error=None, chat_id=None):
+        """Account for the finished send handed out at `position` (to `chat_id`, for the ledger)."""
+        self.in_flight -= 1
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if self.ledger is not None and chat_id is not None:
+            self.ledger.add(self.broadcast_id, chat_id, error)
+
+        # Sends finish roughly in order, so the matching unit is near the front
+        for batch in self._batches:
+            if position < batch[1]:
+                batch[2] -= 1
+                batch[3 if error is None else 4] += 1
+                break
+
+        while self._batches and self._batches[0][2] == 0:
+            last_id, _, _, sent, failed = self._batches.popleft()
+            self.cursor_id = last_id
+            self.confirmed_sent += sent
+            self.confirmed_failed += failed
+
+    def abandon(self, position):
+        """
+        Give up on the send handed out at `position` without an outcome. Its
+        checkpoint unit never completes, so cursor_id stays before it and the
+        recipient is sent to again when the chunk is resumed.
+        """
+        self.in_flight -= 1
+        self._abandoned = True
+
+    def settle(self):
+        """
+        Move the checkpoint right after the last recipient handed out, inside
+        its unit, once every send handed out has finished. For a graceful
+        stop: resuming then sends to nobody twice. Does nothing while sends
+        are in flight or after one was abandoned, whose unit must be re-sent.
+        """
+        if self.in_flight or self._abandoned or self._last_id is None:
+            return
+        if self._batches:
+            # Outcomes so far are all in sent/failed now; the unit keeps only its recipients not handed out
+            self._batches[0][3] = self._batches[0][4] = 0
+        self.cursor_id = self._last_id
+        self.confirmed_sent = self.sent
+        self.confirmed_failed = self.failed
+
+    def send(self, chat_id):
+        return self.payload.send(self.bot, chat_id)
+
+
+def delivery_status(error):
+    if error is None:
+        return "sent"
+    if is_unreachable(error):
+        return "blocked"
+    if isinstance(error, RetryAfter):
+        return "retry_after"
+    return "error"
+
+
+def record_deliveries(db, rows):
+    """Write a batch of delivery outcomes with one multi-row INSERT; a re-send after a resume overwrites."""
+    stmt = dialect_insert(BroadcastDelivery).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[BroadcastDelivery.broadcast_id, BroadcastDelivery.telegram_user_id],
+        set_={"status": stmt.excluded.status, "error": stmt.excluded.error, "created_at": func.now()},
+    ))
+    db.commit()
+    return len(rows)
+
+
+def delivery_summary(db, broadcast_id):
+    """Number of recipients per delivery status of a broadcast."""
+    return dict(db.execute(
+        select(BroadcastDelivery.status, func.count())
+        .where(BroadcastDelivery.broadcast_id == broadcast_id)
+        .group_by(BroadcastDelivery.status)
+    ).all())
+
+
+class DeliveryLedger(BatchWriter):
+    """Collects per-recipient outcomes of broadcast sends and writes them to broadcast_deliveries in batches."""
+
+    def __init__(self, interval=BROADCAST_LEDGER_INTERVAL, max_batch=BROADCAST_LEDGER_BATCH_SIZE):
+        super().__init__(interval, max_batch)
+
+    def add(self, broadcast_id, telegram_user_id, error=None):
+        # Keyed by recipient, so a batch never repeats a key of the upsert
+        self.put((broadcast_id, telegram_user_id), {
+            "broadcast_id": broadcast_id,
+            "telegram_user_id": telegram_user_id,
+            "status": delivery_status(error),
+            "error": None if error is None else str(error)[:500],
+        })
+
+    async def write(self, batch):
+        if await safe_db_query(lambda db: record_deliveries(db, batch)) is None:
+            logger.error("Failed to record %d broadcast deliveries.", len(batch))
+
+
+def create_broadcast(db, admin_chat_id, payload, total, segment=None, scheduled_at=None, delivery_window=None):
+    """
+    Store a draft broadcast to `total` recipients in `segment`, to start at
+    `scheduled_at` and be spread over `delivery_window` seconds; nothing is
+    sent until it's confirmed.
+    """
+    record = Broadcast(
+        admin_chat_id=admin_chat_id,
+        status="draft",
+        text=payload.text,
+        photo=payload.photo,
+        buttons=payload.buttons,
+        segment=segment or None,
+        total=total,
+        scheduled_at=scheduled_at,
+        delivery_window=delivery_window,
+    )
+    db.add(record)
+    db.commit()
+    return record.id
+
+
+def _start_broadcast(db, broadcast_id, segment, chunk_size):
+    """Mark a broadcast running and split the users.id range of its segment into claimable chunks."""
+    now = datetime.utcnow()
+    db.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(started_at=now, progress_reported_at=now))
+    min_id, max_id = recipient_id_range(db, segment)
+    if max_id is None:
+        # Nobody left to send to; there are no chunks to complete it later
+        db.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(status="completed", finished_at=func.now()))
+    else:
+        db.bulk_insert_mappings(BroadcastChunk, [
+            {"broadcast_id": broadcast_id, "start_id": start, "end_id": min(start + chunk_size, max_id), "cursor_id": start}
+            for start in range(min_id - 1, max_id, chunk_size)
+        ])
+
+
+def confirm_broadcast(db, broadcast_id, progress_message_id=None, chunk_size=BROADCAST_CHUNK_SIZE):
+    """
+    Confirm a draft broadcast: start it, or leave it "scheduled" if its
+    scheduled_at is still ahead. Progress reports edit `progress_message_id`
+    in the admin's chat when given. Returns the broadcast's (status, total,
+    scheduled_at, delivery_window), or None if it was not a draft (already
+    confirmed or cancelled).
+    """
+    record = db.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status == "draft")
+        .values(
+            status=case((Broadcast.scheduled_at > datetime.utcnow(), "scheduled"), else_="running"),
+            progress_message_id=progress_message_id,
+        )
+        .returning(Broadcast.status, Broadcast.segment, Broadcast.total, Broadcast.scheduled_at, Broadcast.delivery_window)
+    ).first()
+    if record is None:
+        db.rollback()
+        return None
+    if record.status == "running":
+        _start_broadcast(db, broadcast_id, record.segment, chunk_size)
+    db.commit()
+    return record
+
+
+def start_due_broadcasts(db, chunk_size=BROADCAST_CHUNK_SIZE):
+    """
+    Start the scheduled broadcasts whose time has come; exactly one replica
+    starts each. The audience is counted again, so users who signed up since
+    the broadcast was drafted get it too. Returns [(id, total)].
+    """
+    due = db.execute(
+        update(Broadcast)
+        .where(Broadcast.status == "scheduled", Broadcast.scheduled_at <= datetime.utcnow())
+        .values(status="running")
+        .returning(Broadcast.id, Broadcast.segment)
+    ).all()
+    started = []
+    for row in due:
+        total = count_recipients(db, segment=row.segment)
+        db.execute(update(Broadcast).where(Broadcast.id == row.id).values(total=total))
+        _start_broadcast(db, row.id, row.segment, chunk_size)
+        started.append((row.id, total))
+    db.commit()
+    return started
+
+
+def cancel_broadcast(db, broadcast_id):
+    """Discard a draft or scheduled broadcast. Returns False if it was already started or cancelled."""
+    result = db.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status.in_(("draft", "scheduled")))
+        .values(status="cancelled")
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
+def claim_chunk(db, replica_id, lease_ttl=BROADCAST_LEASE_TTL):
+    """
+    Lease the next pending chunk of a running broadcast, or one whose owner
+    stopped renewing its lease. SKIP LOCKED lets replicas claim concurrently
+    without waiting on each other. Returns (broadcast, chunk) or None.
+    """
+    now = datetime.utcnow()
+    candidate = (
+        select(BroadcastChunk.id)
+        .join(Broadcast, Broadcast.id == BroadcastChunk.broadcast_id)
+        .where(
+            Broadcast.status == "running",
+            or_(
+                BroadcastChunk.status == "pending",
+                (BroadcastChunk.status == "running") & (BroadcastChunk.lease_expires_at < now),
+            ),
+        )
+        .order_by(BroadcastChunk.id)
+        .limit(1)
+        .with_for_update(of=BroadcastChunk, skip_locked=True)
+    )
+    chunk_id = db.scalar(candidate)
+    if chunk_id is None:
+        db.rollback()
+        return None
+
+    chunk = db.get(BroadcastChunk, chunk_id)
+    chunk.status = "running"
+    chunk.owner = replica_id
+    chunk.lease_expires_at = now + timedelta(seconds=lease_ttl)
+    record = db.get(Broadcast, chunk.broadcast_id)
+    db.flush()
+    # Detach both so their loaded state survives the commit
+    db.expunge(chunk)
+    db.expunge(record)
+    db.commit()
+    return record, chunk
+
+
+def save_checkpoint(db, job, replica_id, lease_ttl=BROADCAST_LEASE_TTL):
+    """Checkpoint a chunk and renew its lease. Returns False if another replica has taken the chunk over."""
+    result = db.execute(
+        update(BroadcastChunk)
+        .where(BroadcastChunk.id == job.chunk_id, BroadcastChunk.owner == replica_id, BroadcastChunk.status == "running")
+        .values(
+            cursor_id=job.cursor_id,
+            sent=job.confirmed_sent,
+            failed=job.confirmed_failed,
+            lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_ttl),
+        )
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
+def release_chunk(db, job, replica_id):
+    """Checkpoint a chunk and hand it back so another replica can continue right away."""
+    db.execute(
+        update(BroadcastChunk)
+        .where(BroadcastChunk.id == job.chunk_id, BroadcastChunk.owner == replica_id, BroadcastChunk.status == "running")
+        .values(
+            cursor_id=job.cursor_id,
+            sent=job.confirmed_sent,
+            failed=job.confirmed_failed,
+            status="pending",
+            owner=None,
+            lease_expires_at=None,
+        )
+    )
+    db.commit()
+
+
+def finish_chunk(db, job, replica_id):
+    """
+    Mark a chunk done. If it was the last one, complete the broadcast and
+    return it; exactly one replica gets the broadcast back.
+    """
+    db.execute(
+        update(BroadcastChunk)
+        .where(BroadcastChunk.id == job.chunk_id, BroadcastChunk.owner == replica_id)
+        .values(cursor_id=job.end_id, sent=job.confirmed_sent, failed=job.confirmed_failed, status="done")
+    )
+    db.commit()
+
+    chunks = select(BroadcastChunk).where(BroadcastChunk.broadcast_id == job.broadcast_id)
+    completed = db.execute(
+        update(Broadcast)
+        .where(
+            Broadcast.id == job.broadcast_id,
+            Broadcast.status == "running",
+            ~exists(chunks.where(BroadcastChunk.status != "done")),
+        )
+        .values(
+            status="completed",
+            finished_at=func.now(),
+            sent=select(func.coalesce(func.sum(BroadcastChunk.sent), 0))
+            .where(BroadcastChunk.broadcast_id == job.broadcast_id).scalar_subquery(),
+            failed=select(func.coalesce(func.sum(BroadcastChunk.failed), 0))
+            .where(BroadcastChunk.broadcast_id == job.broadcast_id).scalar_subquery(),
+        )
+        .returning(Broadcast.id, Broadcast.admin_chat_id, Broadcast.progress_message_id, Broadcast.total,
+                   Broadcast.sent, Broadcast.failed, Broadcast.started_at, Broadcast.finished_at)
+    ).first()
+    db.commit()
+    return completed
+
+
+def claim_progress_reports(db, interval=BROADCAST_PROGRESS_INTERVAL):
+    """
+    Return the running broadcasts whose progress report is due, as
+    (broadcast, sent, failed, msgs/s since the previous report) with the
+    checkpointed counts. Each report is claimed by exactly one replica: the
+    claim only succeeds if progress_reported_at is still what we read. A
+    report that would show the same count as the previous one is claimed but
+    not returned, as Telegram refuses an edit that doesn't change the message.
+    """
+    now = datetime.utcnow()
+    due = db.execute(
+        select(
+            Broadcast.id, Broadcast.admin_chat_id, Broadcast.progress_message_id, Broadcast.total,
+            Broadcast.progress_done, Broadcast.progress_reported_at,
+        )
+        .where(
+            Broadcast.status == "running",
+            or_(Broadcast.progress_reported_at.is_(None),
+                Broadcast.progress_reported_at < now - timedelta(seconds=interval)),
+        )
+    ).all()
+    if not due:
+        db.rollback()
+        return []
+
+    counts = dict(
+        (row.broadcast_id, row) for row in db.execute(
+            select(
+                BroadcastChunk.broadcast_id,
+                func.sum(BroadcastChunk.sent).label("sent"),
+                func.sum(BroadcastChunk.failed).label("failed"),
+            )
+            .where(BroadcastChunk.broadcast_id.in_([row.id for row in due]))
+            .group_by(BroadcastChunk.broadcast_id)
+        )
+    )
+
+    reports = []
+    for row in due:
+        sent, failed = (counts[row.id].sent, counts[row.id].failed) if row.id in counts else (0, 0)
+        claimed = db.execute(
+            update(Broadcast)
+            .where(Broadcast.id == row.id, Broadcast.progress_reported_at == row.progress_reported_at)
+            .values(progress_reported_at=now, progress_done=sent + failed)
+        ).rowcount
+        if claimed and sent + failed != row.progress_done:
+            elapsed = (now - row.progress_reported_at).total_seconds() if row.progress_reported_at else 0
+            rate = max(0, sent + failed - row.progress_done) / elapsed if elapsed > 0 else 0.0
+            reports.append((row, sent, failed, rate))
+    db.commit()
+    return reports
+
+
+def paced_chunk_rates(db):
+    """
+    The send rate of each running chunk of the running broadcasts that have
+    a delivery window, as {broadcast id: recipients per second}: what is
+    left of the broadcast spread evenly over what is left of its window,
+    split between the chunks being sent right now (on whichever replicas).
+    Past the end of the window the rate is None, i.e. as fast as allowed.
+    """
+    now = datetime.utcnow()
+    rows = db.execute(
+        select(
+            Broadcast.id, Broadcast.total, Broadcast.started_at, Broadcast.delivery_window,
+            func.sum(BroadcastChunk.sent + BroadcastChunk.failed).label("done"),
+            func.sum(case((BroadcastChunk.status == "running", 1), else_=0)).label("running"),
+        )
+        .join(BroadcastChunk, BroadcastChunk.broadcast_id == Broadcast.id)
+        .where(Broadcast.status == "running", Broadcast.delivery_window.isnot(None))
+        .group_by(Broadcast.id)
+    ).all()
+    db.rollback()
+
+    rates = {}
+    for row in rows:
+        left = (row.started_at + timedelta(seconds=row.delivery_window) - now).total_seconds()
+        # total is the count at the start, so keep every running chunk moving even if it's been reached
+        remaining = max(row.total - row.done, row.running)
+        rates[row.id] = remaining / left / max(row.running, 1) if left > 0 else None
+    return rates
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def describe_schedule(scheduled_at, delivery_window, total, max_rate):
+    """When and how fast a broadcast to `total` users is sent, given the bot's `max_rate` send budget."""
+    when = f"at {scheduled_at:%Y-%m-%d %H:%M} UTC" if scheduled_at else "now"
+    if not delivery_window:
+        return f"starting {when}, as fast as allowed (about {format_duration(total / max_rate)})"
+    rate = total / delivery_window
+    text = f"starting {when}, spread over {format_duration(delivery_window)} ({rate:.1f} msgs/s)"
+    if rate > max_rate:
+        text += f"; that's above the {max_rate:g} msgs/s send budget, so it will take about {format_duration(total / max_rate)}"
+    return text
+
+
+def format_progress(broadcast_id, total, sent, failed, rate):
+    done = sent + failed
+    text = (f"Broadcast #{broadcast_id}: {sent} of {total} sent, {failed} failed "
+            f"({100 * done // total if total else 100}%)\n{rate:.0f} msgs/s")
+    if rate > 0 and done < total:
+        text += f", about {format_duration((total - done) / rate)} left"
+    return text
+
+
+class BroadcastManager:
+    """
+    Runs broadcasts as durable jobs shared by all replicas.
+
+    A broadcast is stored in the broadcasts table and split into chunks of
+    BROADCAST_CHUNK_SIZE users.id values. Every replica leases up to
+    BROADCAST_CHUNKS_PER_REPLICA chunks at a time, sends them in keyset
+    batches and checkpoints them every BROADCAST_CHECKPOINT_INTERVAL seconds,
+    which also renews the lease. Chunks of a replica that stops or dies are
+    picked up by the others from their last checkpoint, so adding replicas
+    spreads the work and a restart never loses a broadcast.
+
+    A scheduled broadcast is started by the first replica to tick after its
+    scheduled_at. One with a delivery window is paced: every tick its
+    running chunks get an even share of the rate that finishes it on time.
+
+    Recipients are sent to through `bulk_bot` when one is set, so broadcast
+    traffic has its own connection pool; progress reports to the admin go
+    through the bot that started or ticked the broadcast, by editing the
+    progress message in place. Per-recipient outcomes go to `ledger`.
+    """
+
+    def __init__(self, scheduler, replica_id, bulk_bot=None):
+        self.scheduler = scheduler
+        self.replica_id = replica_id
+        self.bulk_bot = bulk_bot
+        self.ledger = DeliveryLedger()
+        self._jobs = {}
+        # /confirm and the coordination tick both claim; one at a time, so the limit is checked against every claim
+        self._claiming = asyncio.Lock()
+
+    async def draft(self, admin_chat_id, payload, total, segment=None, scheduled_at=None, delivery_window=None):
+        """Store a broadcast awaiting confirmation; returns its id, or None if it couldn't be stored."""
+        broadcast_id = await safe_db_query(
+            lambda db: create_broadcast(db, admin_chat_id, payload, total, segment, scheduled_at, delivery_window)
+        )
+        if broadcast_id is not None:
+            logger.info("Broadcast #%s drafted for %d recipients.", broadcast_id, total)
+        return broadcast_id
+
+    async def confirm(self, bot, broadcast_id, progress_message_id=None):
+        """
+        Start sending a draft, or schedule it; returns confirm_broadcast()'s
+        record, or None if it wasn't a draft. Progress is reported by editing
+        `progress_message_id`.
+        """
+        record = await safe_db_query(lambda db: confirm_broadcast(db, broadcast_id, progress_message_id))
+        if record is None:
+            return None
+        if record.status == "scheduled":
+            logger.info("Broadcast #%s scheduled for %s UTC.", broadcast_id, record.scheduled_at)
+            return record
+        logger.info("Broadcast #%s started for %d recipients.", broadcast_id, record.total)
+        await self.claim(bot)
+        await self.pace()
+        return record
+
+    async def cancel(self, broadcast_id):
+        return bool(await safe_db_query(lambda db: cancel_broadcast(db, broadcast_id)))
+
+    async def tick(self, bot):
+        """
+        Periodic work: start due scheduled broadcasts, claim chunks while
+        there is capacity, pace them and send due progress reports.
+        """
+        for broadcast_id, total in await safe_db_query(start_due_broadcasts) or []:
+            logger.info("Scheduled broadcast #%s started for %d recipients.", broadcast_id, total)
+        await self.claim(bot)
+        await self.pace()
+        for record, sent, failed, rate in await safe_db_query(claim_progress_reports) or []:
+            await self._notify(bot, record.admin_chat_id, format_progress(record.id, record.total, sent, failed, rate),
+                               record.progress_message_id)
+
+    async def claim(self, bot):
+        async with self._claiming:
+            while len(self._jobs) < BROADCAST_CHUNKS_PER_REPLICA:
+                claimed = await safe_db_query(lambda db: claim_chunk(db, self.replica_id))
+                if not claimed:
+                    return
+                record, chunk = claimed
+                job = BroadcastJob.from_chunk(self.bulk_bot or bot, record, chunk, ledger=self.ledger)
+                self._jobs[job.chunk_id] = (job, asyncio.create_task(self._run(job, bot)))
+                logger.info("Claimed chunk %s of broadcast #%s (users.id %s..%s).",
+                            chunk.id, record.id, chunk.cursor_id, chunk.end_id)
+
+    async def pace(self):
+        """Update the rate of this replica's jobs in broadcasts with a delivery window."""
+        if not any(job.rate is not None for job, _ in self._jobs.values()):
+            return
+        rates = await safe_db_query(paced_chunk_rates)
+        if rates is None:
+            return
+        for job, _ in self._jobs.values():
+            if job.broadcast_id in rates:
+                job.rate = rates[job.broadcast_id]
+
+    async def stop(self, drain_timeout=BROADCAST_DRAIN_TIMEOUT):
+        """
+        Stop working on chunks and hand them back with their final
+        checkpoints. Call before stopping the scheduler: no new recipients
+        are handed out, and the sends in flight get `drain_timeout` seconds
+        to finish so the checkpoint can be saved at the last of them.
+        """
+        running = list(self._jobs.values())
+        for job, _ in running:
+            self.scheduler.remove_job(job)
+        deadline = time.monotonic() + drain_timeout
+        while any(job.in_flight for job, _ in running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for _, task in running:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in running), return_exceptions=True)
+        for job, _ in running:
+            job.settle()
+            await safe_db_query(lambda db, job=job: release_chunk(db, job, self.replica_id))
+        await self.ledger.close()
+
+    async def _run(self, job, bot):
+        await self.scheduler.add_job(job)
+        loader = asyncio.create_task(self._load(job))
+        try:
+            while not job.finished.is_set():
+                try:
+                    await asyncio.wait_for(job.finished.wait(), BROADCAST_CHECKPOINT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                if job.finished.is_set():
+                    break
+                if await safe_db_query(lambda db: save_checkpoint(db, job, self.replica_id)) is False:
+                    logger.warning("Lost the lease on chunk %s; another replica took it over.", job.chunk_id)
+                    self.scheduler.remove_job(job)
+                    return
+
+            completed = await safe_db_query(lambda db: finish_chunk(db, job, self.replica_id))
+            if completed:
+                logger.info("Broadcast #%s finished: %d sent, %d failed.", completed.id, completed.sent, completed.failed)
+                await self._finished(bot, completed)
+        finally:
+            loader.cancel()
+            self._jobs.pop(job.chunk_id, None)
+
+    async def _load(self, job):
+        """Feed the job with recipients after its checkpoint, staying about one batch ahead of the senders."""
+        after_id = job.cursor_id
+        while True:
+            await job.needs_recipients.wait()
+            rows = await safe_db_query(
+                lambda db: fetch_recipient_batch(db, after_id, until_id=job.end_id, segment=job.segment)
+            )
+            if rows is None:
+                # Database unavailable; the job keeps its checkpoint, so just try again later
+                await asyncio.sleep(BROADCAST_CHECKPOINT_INTERVAL)
+                continue
+            if not rows:
+                break
+            after_id = rows[-1].id
+            if job.rate is None:
+                job.extend(rows)
+                await self.scheduler.wake()
+            else:
+                await self._feed(job, rows)
+
+        job.close()
+        await self.scheduler.wake()
+
+    async def _feed(self, job, rows):
+        """Hand `rows` to a paced job at job.rate recipients per second, which can change as we go."""
+        allowance = 0.0
+        last = time.monotonic()
+        while rows:
+            if job.rate is None:
+                # The window is over: send the rest as fast as allowed
+                job.extend(rows)
+                await self.scheduler.wake()
+                return
+            now = time.monotonic()
+            # Never more than a second's worth at once, so a pause doesn't turn into a burst
+            allowance = min(allowance + (now - last) * job.rate, max(job.rate, 1.0))
+            last = now
+            if allowance >= 1:
+                count = int(allowance)
+                job.extend(rows[:count])
+                rows = rows[count:]
+                allowance -= count
+                await self.scheduler.wake()
+            await asyncio.sleep(PACING_TICK)
+
+    async def _finished(self, bot, completed):
+        # Only this replica's outcomes are certainly written; other replicas flush theirs within the ledger interval
+        await self.ledger.close()
+        statuses = await safe_db_query(lambda db: delivery_summary(db, completed.id)) or {}
+        elapsed = (completed.finished_at - completed.started_at).total_seconds() if completed.started_at else 0
+        text = format_progress(completed.id, completed.total, completed.sent, completed.failed,
+                               (completed.sent + completed.failed) / elapsed if elapsed > 0 else 0.0)
+        text += f"\nFinished in {format_duration(elapsed)}."
+        failures = {status: count for status, count in statuses.items() if status != "sent"}
+        if failures:
+            text += "\nFailures: " + ", ".join(f"{status} {count}" for status, count in sorted(failures.items()))
+        await self._notify(bot, completed.admin_chat_id, text, completed.progress_message_id)
+        await self._notify(bot, completed.admin_chat_id,
+                           f"Broadcast #{completed.id} finished: {completed.sent} sent, {completed.failed} failed.")
+
+    async def _notify(self, bot, admin_chat_id, text, message_id=None):
+        """Send `text` to the admin, or edit it into `message_id` (the progress message) when given."""
+        if not admin_chat_id:
+            return
+        if message_id:
+            await self.scheduler.submit(admin_chat_id, lambda: bot.edit_message_text(
+                text=text,
+                chat_id=admin_chat_id,
+                message_id=message_id
+            ))
+        else:
+            await self.scheduler.submit(admin_chat_id, lambda: bot.send_message(
+                chat_id=admin_chat_id,
+                text=text
+            ))
@@ -0,0 +1,60 @@
+# coordination.py
+
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select
+from database import dialect_insert, safe_db_query
+from models import Replica
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+REPLICA_HEARTBEAT_INTERVAL = float(os.getenv("REPLICA_HEARTBEAT_INTERVAL", "5"))
+REPLICA_TTL = float(os.getenv("REPLICA_TTL", "20"))
+
+
+def heartbeat(db, replica_id, ttl=REPLICA_TTL):
+    """Record that `replica_id` is alive; returns the number of live replicas."""
+    now = datetime.utcnow()
+    stmt = dialect_insert(Replica).values(replica_id=replica_id, heartbeat_at=now)
+    stmt = stmt.on_conflict_do_update(index_elements=[Replica.replica_id], set_={"heartbeat_at": now})
+    db.execute(stmt)
+    # Forget replicas that have been gone for a while
+    db.execute(delete(Replica).where(Replica.heartbeat_at < now - timedelta(hours=1)))
+    live = db.scalar(select(func.count()).select_from(Replica).where(Replica.heartbeat_at >= now - timedelta(seconds=ttl)))
+    db.commit()
+    return live
+
+
+def leave(db, replica_id):
+    db.execute(delete(Replica).where(Replica.replica_id == replica_id))
+    db.commit()
+
+
+class ReplicaCoordinator:
+    """
+    Keeps track of the live bot replicas through heartbeats in the replicas
+    table. Telegram's rate limit applies to the bot token, not to a process,
+    so the global send budget is split evenly between the live replicas.
+    """
+
+    def __init__(self, sender, global_rate, replica_id=REPLICA_ID):
+        self.sender = sender
+        self.global_rate = global_rate
+        self.replica_id = replica_id
+        self.live_replicas = 1
+
+    async def heartbeat(self):
+        live = await safe_db_query(lambda db: heartbeat(db, self.replica_id))
+        if not live:
+            return
+        if live != self.live_replicas:
+            logger.info("%d live replicas, sending at up to %.1f msgs/s here.", live, self.global_rate / live)
+        self.live_replicas = live
+        self.sender.set_max_rate(self.global_rate / live)
+
+    async def leave(self):
+        await safe_db_query(lambda db: leave(db, self.replica_id))
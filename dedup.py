@@ -0,0 +1,79 @@
+# dedup.py
+
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from database import dialect_insert, safe_db_query
+from models import ProcessedUpdate
+
+logger = logging.getLogger(__name__)
+
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+# Also record update_ids in the database so a retry delivered to another replica is caught too
+UPDATE_DEDUP_SHARED = os.getenv("UPDATE_DEDUP_SHARED", "false").lower() in ("1", "true", "yes")
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", "3600"))
+
+
+def claim_update(db, update_id):
+    """Record `update_id` as processed; returns False if some replica already did."""
+    stmt = (
+        dialect_insert(ProcessedUpdate)
+        .values(update_id=update_id, created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+        .returning(ProcessedUpdate.update_id)
+    )
+    claimed = db.execute(stmt).first()
+    db.commit()
+    return claimed is not None
+
+
+def prune_processed_updates(db, ttl=UPDATE_DEDUP_TTL):
+    result = db.execute(delete(ProcessedUpdate).where(ProcessedUpdate.created_at < datetime.utcnow() - timedelta(seconds=ttl)))
+    db.commit()
+    return result.rowcount
+
+
+class RecentIds:
+    """Bounded set of recently seen ids; adding and checking are O(1)."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._ids = {}  # dicts keep insertion order, so the oldest id is always first
+
+    def add(self, item):
+        """Returns False if `item` was already seen."""
+        if item in self._ids:
+            return False
+        self._ids[item] = None
+        if len(self._ids) > self.maxsize:
+            del self._ids[next(iter(self._ids))]
+        return True
+
+
+class UpdateDeduplicator:
+    """
+    Drops webhook updates Telegram delivered more than once, e.g. after a
+    slow response. Checks a bounded in-memory set of recent update_ids and,
+    with `shared`, the processed_updates table used by every replica.
+    """
+
+    def __init__(self, maxsize=UPDATE_DEDUP_SIZE, shared=UPDATE_DEDUP_SHARED):
+        self.shared = shared
+        self.duplicates = 0
+        self._recent = RecentIds(maxsize)
+
+    async def is_duplicate(self, update_id):
+        duplicate = not self._recent.add(update_id)
+        if not duplicate and self.shared:
+            # A failed query counts as new: better to process twice than to drop an update
+            duplicate = await safe_db_query(lambda db: claim_update(db, update_id)) is False
+        if duplicate:
+            self.duplicates += 1
+        return duplicate
+
+    async def prune(self):
+        if self.shared:
+            pruned = await safe_db_query(prune_processed_updates)
+            if pruned:
+                logger.info("Pruned %d processed update_ids.", pruned)
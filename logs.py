@@ -0,0 +1,98 @@
+# logs.py
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_SUMMARY_INTERVAL = float(os.getenv("LOG_SUMMARY_INTERVAL", "60"))
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Attributes every LogRecord has; anything else was passed in `extra=` and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with `extra=` fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Route all logging through a queue: callers only format and enqueue the
+    record, and a background thread writes it to stdout.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(records)]
+    root.setLevel(level)
+    # httpx logs a line per request, which at broadcast scale is one per recipient,
+    # and the job queue two lines per run of every periodic job
+    for name in ("httpx", "apscheduler"):
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+    return listener
+
+
+class EventCounter:
+    """
+    Aggregates high-volume events (one per update or per recipient) into a
+    single summary line every `interval` seconds. The first occurrence of an
+    event in each interval can still be logged in full as a sample.
+    """
+
+    def __init__(self, interval=LOG_SUMMARY_INTERVAL, logger=None):
+        self.interval = interval
+        self.logger = logger or logging.getLogger("events")
+        self._counts = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+    def count(self, event, sample=None, *args, level=logging.INFO):
+        """Count one `event`; `sample % args` is logged at `level` if it's the first one this interval."""
+        seen = self._counts.get(event, 0)
+        self._counts[event] = seen + 1
+        if not seen and sample and self.logger.isEnabledFor(level):
+            self.logger.log(level, sample, *args, extra={"event": event})
+        if self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(self.interval, self.flush)
+            except RuntimeError:
+                pass  # no event loop; counts go out with the next flush
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        counts, self._counts = self._counts, {}
+        if counts:
+            summary = ", ".join(f"{event}={count}" for event, count in sorted(counts.items()))
+            self.logger.info("Event counts since the last summary: %s", summary, extra={"counts": counts})
+
+
+# Shared by all modules, so there is one summary line per interval
+events = EventCounter()
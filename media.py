@@ -0,0 +1,137 @@
+# media.py
+
+import asyncio
+import hashlib
+import logging
+import os
+from sqlalchemy import func, select
+from telegram.error import BadRequest
+from database import dialect_insert, safe_db_query
+from models import MediaFile
+
+logger = logging.getLogger(__name__)
+
+
+def is_invalid_file_id(error):
+    """True when Telegram rejected a cached file_id, so the file has to be uploaded again."""
+    message = str(error).lower()
+    return isinstance(error, BadRequest) and ("file identifier" in message or "file_id" in message)
+
+
+def store_file_id(db, content_hash, media_type, file_id):
+    stmt = dialect_insert(MediaFile).values(content_hash=content_hash, media_type=media_type, file_id=file_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaFile.content_hash],
+        set_={"file_id": stmt.excluded.file_id, "updated_at": func.now()},
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+class MediaCache:
+    """
+    Telegram file_id cache for local media files.
+
+    Entries are keyed by the SHA-256 of the file contents, so editing an asset
+    invalidates its entry, and they are stored in the media_files table so
+    every replica reuses the same upload. Sends of an asset that has no
+    file_id yet share one lookup-or-upload instead of each uploading the file.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._file_ids = {}
+        self._hashes = {}
+        self._resolving = {}
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as media_file:
+            for chunk in iter(lambda: media_file.read(1 << 16), b''):
+                digest.update(chunk)
+        self._hashes[path] = ((stat.st_mtime_ns, stat.st_size), digest.hexdigest())
+        return digest.hexdigest()
+
+    async def warm(self, paths=()):
+        """Load every known file_id from the database and pre-hash the given assets."""
+        rows = await safe_db_query(lambda db: db.execute(select(MediaFile.content_hash, MediaFile.file_id)).all())
+        for row in rows or []:
+            self._file_ids[row.content_hash] = row.file_id
+        for path in paths:
+            if path and os.path.isfile(path):
+                self.content_hash(path)
+        logger.info("Media cache warmed with %d file_ids.", len(self._file_ids))
+
+    async def send_animation(self, bot, chat_id, path, **kwargs):
+        return await self.send(
+            path,
+            "animation",
+            lambda animation: bot.send_animation(chat_id=chat_id, animation=animation, **kwargs),
+            lambda message: message.animation.file_id,
+        )
+
+    async def send_photo(self, bot, chat_id, path, **kwargs):
+        return await self.send(
+            path,
+            "photo",
+            lambda photo: bot.send_photo(chat_id=chat_id, photo=photo, **kwargs),
+            lambda message: message.photo[-1].file_id,
+        )
+
+    async def send(self, path, media_type, send, extract_file_id):
+        """
+        Call `send(media)` with the cached file_id for `path`, uploading the
+        file (and caching the resulting file_id) when there is none yet.
+        """
+        content_hash = self.content_hash(path)
+        rejected = None
+        file_id = self._file_ids.get(content_hash)
+        if file_id:
+            self.hits += 1
+            try:
+                return await send(file_id)
+            except BadRequest as e:
+                if not is_invalid_file_id(e):
+                    raise
+                logger.warning("Cached file_id for %s is invalid. Re-uploading.", path)
+                rejected = file_id
+                if self._file_ids.get(content_hash) == file_id:
+                    del self._file_ids[content_hash]
+        self.misses += 1
+
+        # Someone else may already be looking up or uploading this asset. If
+        # their upload failed (e.g. that user blocked the bot) the next waiter
+        # takes over and the rest wait for it in turn
+        while (resolving := self._resolving.get(content_hash)) is not None:
+            file_id = await asyncio.shield(resolving)
+            if file_id:
+                return await send(file_id)
+
+        resolving = asyncio.get_running_loop().create_future()
+        self._resolving[content_hash] = resolving
+        try:
+            # Another replica may have uploaded it since we warmed the cache
+            stored = await safe_db_query(
+                lambda db: db.scalar(select(MediaFile.file_id).where(MediaFile.content_hash == content_hash))
+            )
+            if stored and stored != rejected:
+                self._file_ids[content_hash] = stored
+                return await send(stored)
+
+            with open(path, 'rb') as media_file:
+                message = await send(media_file)
+            file_id = extract_file_id(message)
+            self._file_ids[content_hash] = file_id
+            await safe_db_query(lambda db: store_file_id(db, content_hash, media_type, file_id))
+            logger.info("Uploaded %s and cached its file_id.", path)
+            return message
+        finally:
+            if self._resolving.get(content_hash) is resolving:
+                del self._resolving[content_hash]
+            resolving.set_result(self._file_ids.get(content_hash))
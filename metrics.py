@@ -0,0 +1,184 @@
+# metrics.py
+
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit up to a slow Bot API call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    """The metrics exposed on /metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                logger.error("Could not collect metric %s: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=(), function=None, registry=REGISTRY):
+        """
+        `function`, when given, is called at scrape time instead of tracking
+        values here: it returns a number, or a dict of label values -> number.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}
+        if not self.labels and self.kind != "histogram":
+            self._values[()] = 0
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _collect(self):
+        if self.function is None:
+            return self._values.items()
+        values = self.function()
+        if not isinstance(values, dict):
+            return [((), values)]
+        return [(tuple(str(value) for value in key), value) for key, value in values.items()]
+
+    def samples(self):
+        for key, value in self._collect():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class _Timer:
+    """Observes the elapsed time of a `with` block, or of every call of a decorated coroutine function."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.histogram.observe(time.perf_counter() - started, **self.labels)
+        return timed
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labels, registry=registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # [per-bucket counts (not cumulative), sum]
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, registry):
+        self.registry = registry
+
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(self.registry.render())
+
+
+def start_metrics_server(port, registry=REGISTRY):
+    """Serve /metrics on `port` from the running event loop, next to the webhook server."""
+    app = tornado.web.Application([(r"/metrics", MetricsHandler, {"registry": registry})])
+    server = HTTPServer(app)
+    server.listen(port)
+    logger.info("Serving metrics on port %d.", port)
+    return server
@@ -0,0 +1,121 @@
+# migrations.py
+#
+# Helpers for Alembic migrations that run while the bot is serving traffic.
+#
+# Every migration runs in its own transaction with lock_timeout set (see
+# alembic/env.py), so DDL that can't get its lock quickly fails instead of
+# queueing /start inserts behind it; just run the upgrade again. Work that
+# takes long on a big table goes outside that transaction:
+#
+#   create_index_concurrently()  instead of op.create_index() on users
+#   backfill()                   instead of one big UPDATE/INSERT ... SELECT
+#
+# op.add_column() with a constant or now() default is metadata-only on
+# PostgreSQL 11+; for a volatile default (or a value computed from other
+# columns) add the column nullable, backfill() it, then make it NOT NULL.
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from alembic import op
+from sqlalchemy import text
+
+logger = logging.getLogger("alembic.online")
+
+# How long DDL may wait for its lock before the migration fails, e.g. "5s" (PostgreSQL syntax; 0 waits forever)
+MIGRATION_LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "5s")
+# Rows of the key range per backfill statement, and the pause between statements
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "10000"))
+MIGRATION_BATCH_PAUSE = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.1"))
+
+
+def _is_postgresql():
+    return op.get_context().dialect.name == "postgresql"
+
+
+@contextmanager
+def lock_timeout(value):
+    """Use a different lock_timeout inside the block (PostgreSQL only)."""
+    if not _is_postgresql():
+        yield
+        return
+    op.execute(f"SET lock_timeout = '{value}'")
+    try:
+        yield
+    finally:
+        op.execute(f"SET lock_timeout = '{MIGRATION_LOCK_TIMEOUT}'")
+
+
+def _index_valid(index_name):
+    """True for a valid index, False for one left INVALID by an interrupted build, None if there is none."""
+    if op.get_context().as_sql:
+        return None
+    return op.get_bind().execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": index_name}
+    ).scalar()
+
+
+def create_index_concurrently(index_name, table_name, columns, **kwargs):
+    """
+    op.create_index() that doesn't block writes to the table on PostgreSQL:
+    the index is built with CREATE INDEX CONCURRENTLY outside the migration's
+    transaction. An INVALID index left by an earlier, interrupted run is
+    dropped and rebuilt; a valid one is kept, so the migration can be rerun.
+    """
+    if not _is_postgresql():
+        op.create_index(index_name, table_name, columns, **kwargs)
+        return
+    # The build waits for every transaction that predates it, which must not count as a lock timeout
+    with op.get_context().autocommit_block(), lock_timeout(0):
+        valid = _index_valid(index_name)
+        if valid is False:
+            logger.warning("Dropping invalid index %s left by an interrupted build.", index_name)
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+        if not valid:
+            op.create_index(index_name, table_name, columns, postgresql_concurrently=True, **kwargs)
+
+
+def drop_index_concurrently(index_name, table_name):
+    if not _is_postgresql():
+        op.drop_index(index_name, table_name=table_name)
+        return
+    with op.get_context().autocommit_block(), lock_timeout(0):
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"')
+
+
+def backfill(statement, table_name, key="id", batch_size=MIGRATION_BATCH_SIZE, pause=MIGRATION_BATCH_PAUSE):
+    """
+    Run the SQL `statement` over `table_name` in ranges of `key`, bound as
+    :start (exclusive) and :end (inclusive). Each range commits on its own,
+    so row locks are held for one batch rather than the whole migration, and
+    the `pause` between batches leaves the database room for live traffic.
+
+    The batches already committed stay if the migration fails, so the
+    statement must be safe to repeat, or the migration must undo them.
+    In offline (--sql) mode the statement is emitted once for all rows.
+    """
+    context = op.get_context()
+    if context.as_sql:
+        op.execute(text(statement).bindparams(start=-1, end=2 ** 63 - 1))
+        return
+
+    with context.autocommit_block():
+        bind = op.get_bind()
+        low, high = bind.execute(text(f"SELECT MIN({key}), MAX({key}) FROM {table_name}")).one()
+        if low is None:
+            return
+        batches = 0
+        started = time.monotonic()
+        start = low - 1
+        while start < high:
+            end = min(start + batch_size, high)
+            bind.execute(text(statement), {"start": start, "end": end})
+            batches += 1
+            if batches % 100 == 0:
+                logger.info("Backfilled %s up to %s=%d of %d.", table_name, key, end, high)
+            start = end
+            if pause and start < high:
+                time.sleep(pause)
+        logger.info("Backfilled %s in %d batches (%.1f s).", table_name, batches, time.monotonic() - started)
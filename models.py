@@ -1,5 +1,5 @@
 # models.py (example)
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, func
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, JSON, ForeignKey, Index, func, text
 from database import Base
 
 class User(Base):
@@ -13,3 +13,143 @@ class User(Base):
     first_start_param = Column(String, nullable=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    # Set when a send fails because the user blocked the bot or deleted their account
+    blocked_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Keyset scans over reachable recipients stay index-only, signup window filters included
+        Index(
+            "ix_users_reachable_id",
+            "id",
+            postgresql_include=["telegram_user_id", "created_at"],
+            postgresql_where=text("blocked_at IS NULL"),
+            sqlite_where=text("blocked_at IS NULL"),
+        ),
+        # Broadcasts to one referral campaign: index-only keyset scans within the campaign
+        Index(
+            "ix_users_reachable_ref_id",
+            "first_start_param",
+            "id",
+            postgresql_include=["telegram_user_id", "created_at"],
+            postgresql_where=text("blocked_at IS NULL"),
+            sqlite_where=text("blocked_at IS NULL"),
+        ),
+        # Broadcasts to a signup window: index-only count and users.id range of the window's recipients
+        Index(
+            "ix_users_reachable_created_at_id",
+            "created_at",
+            "id",
+            postgresql_include=["telegram_user_id"],
+            postgresql_where=text("blocked_at IS NULL"),
+            sqlite_where=text("blocked_at IS NULL"),
+        ),
+        # Users recently marked unreachable by any replica, to drop from the profile caches
+        Index(
+            "ix_users_blocked_at",
+            "blocked_at",
+            postgresql_where=text("blocked_at IS NOT NULL"),
+            sqlite_where=text("blocked_at IS NOT NULL"),
+        ),
+    )
+
+class MediaFile(Base):
+    """Telegram file_id of an uploaded media asset, keyed by a hash of its contents."""
+    __tablename__ = "media_files"
+
+    content_hash = Column(String(64), primary_key=True)
+    media_type = Column(String, nullable=False)
+    file_id = Column(String, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+class Broadcast(Base):
+    """
+    A broadcast job. It starts as a draft until the admin confirms the
+    recipient count; then its recipients are split into chunks that any
+    replica can claim. A broadcast confirmed for a later time waits as
+    "scheduled" until scheduled_at.
+    """
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    admin_chat_id = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False, server_default="running")
+    text = Column(Text, nullable=True)
+    photo = Column(String, nullable=True)
+    buttons = Column(JSON, nullable=False)
+    # Audience filters ({"ref": ..., "since": ..., "until": ...}); NULL means every reachable user
+    segment = Column(JSON, nullable=True)
+    total = Column(Integer, nullable=False, server_default="0")
+    # When to start sending (NULL: on confirmation), and the seconds to spread the sends over (NULL: as fast as allowed)
+    scheduled_at = Column(DateTime, nullable=True)
+    delivery_window = Column(Integer, nullable=True)
+    # Final totals, filled in from the chunks when the broadcast completes
+    sent = Column(Integer, nullable=False, server_default="0")
+    failed = Column(Integer, nullable=False, server_default="0")
+    # The admin's message that is edited with live progress, and the sent + failed count it last showed
+    progress_message_id = Column(BigInteger, nullable=True)
+    progress_done = Column(Integer, nullable=False, server_default="0")
+    progress_reported_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class BroadcastChunk(Base):
+    """A users.id range (start_id, end_id] of a broadcast, leased by one replica at a time."""
+    __tablename__ = "broadcast_chunks"
+
+    id = Column(Integer, primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), nullable=False, index=True)
+    start_id = Column(Integer, nullable=False)
+    end_id = Column(Integer, nullable=False)
+    # Every recipient in (start_id, cursor_id] has been sent to (or failed permanently)
+    cursor_id = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, server_default="pending")
+    owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    sent = Column(Integer, nullable=False, server_default="0")
+    failed = Column(Integer, nullable=False, server_default="0")
+
+    __table_args__ = (
+        Index("ix_broadcast_chunks_status_id", "status", "id"),
+    )
+
+class BroadcastDelivery(Base):
+    """Outcome of a broadcast's send to one recipient: sent, blocked, retry_after or error."""
+    __tablename__ = "broadcast_deliveries"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), primary_key=True)
+    telegram_user_id = Column(BigInteger, primary_key=True)
+    status = Column(String, nullable=False)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+class Replica(Base):
+    """Liveness record of a running bot process."""
+    __tablename__ = "replicas"
+
+    replica_id = Column(String, primary_key=True)
+    started_at = Column(DateTime, server_default=func.now(), nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+class ProcessedUpdate(Base):
+    """Webhook update_ids already handled by some replica, for de-duplicating Telegram retries."""
+    __tablename__ = "processed_updates"
+
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+class ReferralDailyStat(Base):
+    """Number of users who signed up per referral code and day, kept up to date by registration."""
+    __tablename__ = "referral_daily_stats"
+
+    # first_start_param, or '' for users who came without one
+    code = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    users = Column(Integer, nullable=False, server_default="0")
+
+    __table_args__ = (
+        # /stats totals over the last few days read only those days' rows, index-only
+        Index("ix_referral_daily_stats_day_code", "day", "code", postgresql_include=["users"]),
+    )
@@ -0,0 +1,68 @@
+# ordering.py
+
+import asyncio
+from contextlib import asynccontextmanager
+from telegram import Update
+from telegram.ext import Application
+
+# ChatOrderedApplication overrides a private method of PTB 20.3 (pinned in requirements.txt). Should an upgrade
+# rename it, the override would never be called and per-chat ordering would silently stop, so fail loudly instead.
+if not callable(getattr(Application, "_Application__process_update_wrapper", None)):
+    raise ImportError(
+        "telegram.ext.Application has no __process_update_wrapper; ordering.ChatOrderedApplication needs "
+        "python-telegram-bot 20.3"
+    )
+
+
+class ChatLocks:
+    """Per-chat asyncio locks, created on demand and dropped once nobody holds or waits for them."""
+
+    def __init__(self):
+        self._locks = {}  # chat_id -> [lock, holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, chat_id):
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat_id]
+
+
+class ChatOrderedApplication(Application):
+    """
+    Application for use with `concurrent_updates`: updates from different
+    chats are processed concurrently, while updates from the same chat still
+    run one at a time in arrival order.
+
+    Update tasks are started in arrival order and take the chat lock before
+    their first suspension point, and asyncio locks wake waiters first in,
+    first out, so the order per chat is preserved. The chat lock is taken
+    before one of the `concurrent_updates` slots, so updates queued behind
+    a busy chat don't hold slots that other chats could use.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_locks = ChatLocks()
+
+    # Replaces Application.__process_update_wrapper, which PTB 20.3 runs as one task per update and which takes
+    # the concurrency slot before calling process_update (20.4+ has BaseUpdateProcessor for this instead)
+    async def _Application__process_update_wrapper(self, update: object) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await self._process_update_in_slot(update)
+            return
+        async with self.chat_locks.hold(chat.id):
+            await self._process_update_in_slot(update)
+
+    async def _process_update_in_slot(self, update):
+        async with self._concurrent_updates_sem:
+            await self.process_update(update)
+            self.update_queue.task_done()
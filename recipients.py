@@ -0,0 +1,162 @@
+# recipients.py
+
+import logging
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+from batching import BatchWriter
+from database import safe_db_query
+from models import User
+
+logger = logging.getLogger(__name__)
+
+RECIPIENT_BATCH_SIZE = 1000
+
+# Leading `key=value` words of a /broadcast message that narrow down its audience
+SEGMENT_FILTER = re.compile(r"\s*(ref|since|until)=(\S+)")
+
+
+def parse_segment(text):
+    """
+    Split the segment filters off the start of a /broadcast message:
+    ref=<first_start_param> and since=/until=<YYYY-MM-DD> (signup date,
+    until is exclusive). Returns (segment dict, rest of the text); raises
+    ValueError for a malformed date.
+    """
+    segment = {}
+    while text:
+        match = SEGMENT_FILTER.match(text)
+        if not match:
+            break
+        key, value = match.groups()
+        if key in ("since", "until"):
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{key}= must be a date like 2024-06-01, not {value!r}")
+        segment[key] = value
+        text = text[match.end():]
+    return segment, (text or '').strip()
+
+
+def describe_segment(segment):
+    if not segment:
+        return "all users"
+    return ", ".join(f"{key}={value}" for key, value in segment.items())
+
+
+def segment_conditions(segment):
+    """WHERE clauses selecting the reachable recipients in `segment` (None or {} means everyone)."""
+    conditions = [User.blocked_at.is_(None), User.telegram_user_id.isnot(None)]
+    if not segment:
+        return conditions
+    if "ref" in segment:
+        conditions.append(User.first_start_param == segment["ref"])
+    if "since" in segment:
+        conditions.append(User.created_at >= datetime.fromisoformat(segment["since"]))
+    if "until" in segment:
+        conditions.append(User.created_at < datetime.fromisoformat(segment["until"]))
+    return conditions
+
+
+def fetch_recipient_batch(db, after_id=0, limit=RECIPIENT_BATCH_SIZE, until_id=None, segment=None):
+    """
+    Return the next `limit` (id, telegram_user_id) rows after `after_id`,
+    up to and including `until_id` when given.
+
+    Keyset pagination on users.id: each batch is an index range scan that only
+    reads the two columns we need, no matter how deep into the table we are.
+    Users marked unreachable are skipped via the partial ix_users_reachable_id,
+    or ix_users_reachable_ref_id for a referral segment; both include
+    created_at, so signup window filters stay index-only too.
+    """
+    stmt = (
+        select(User.id, User.telegram_user_id)
+        .where(User.id > after_id, *segment_conditions(segment))
+        .order_by(User.id)
+        .limit(limit)
+    )
+    if until_id is not None:
+        stmt = stmt.where(User.id <= until_id)
+    return db.execute(stmt).all()
+
+
+def count_recipients(db, after_id=0, segment=None):
+    """Number of reachable recipients in `segment` with users.id greater than `after_id`."""
+    stmt = (
+        select(func.count())
+        .select_from(User)
+        .where(User.id > after_id, *segment_conditions(segment))
+    )
+    return db.scalar(stmt)
+
+
+def recipient_id_range(db, segment=None):
+    """
+    (min, max) users.id of the recipients in `segment`, or (None, None).
+    Users get increasing ids as they sign up, so a signup window maps to a
+    narrow id range and the broadcast's chunks only cover that range (read
+    from ix_users_reachable_created_at_id).
+    """
+    return db.execute(select(func.min(User.id), func.max(User.id)).where(*segment_conditions(segment))).one()
+
+
+def mark_unreachable(db, telegram_user_ids):
+    """Flag users who blocked the bot or deleted their account; returns the number of rows changed."""
+    result = db.execute(
+        update(User)
+        .where(User.telegram_user_id.in_(telegram_user_ids), User.blocked_at.is_(None))
+        .values(blocked_at=func.now())
+    )
+    db.commit()
+    return result.rowcount
+
+
+def marked_unreachable_since(db, since):
+    """
+    telegram_user_ids marked unreachable after `since` (by any replica), and
+    the latest blocked_at among them, or `since` if there were none. With
+    `since` None, just the latest blocked_at of all users.
+    """
+    if since is None:
+        latest = db.scalar(select(func.max(User.blocked_at)))
+        db.rollback()
+        return [], latest
+    rows = db.execute(select(User.telegram_user_id, User.blocked_at).where(User.blocked_at > since)).all()
+    db.rollback()
+    return [row.telegram_user_id for row in rows], max((row.blocked_at for row in rows), default=since)
+
+
+class UnreachableTracker(BatchWriter):
+    """Collects unreachable recipients during sends and marks them in batches every `interval` seconds."""
+
+    def __init__(self, interval=5.0, max_batch=1000):
+        super().__init__(interval, max_batch)
+        self._seen_until = None
+
+    def add(self, telegram_user_id):
+        self.put(telegram_user_id, telegram_user_id)
+
+    async def write(self, batch):
+        marked = await safe_db_query(lambda db: mark_unreachable(db, batch))
+        if marked is None:
+            logger.error("Failed to mark %d users as unreachable.", len(batch))
+        else:
+            logger.info("Marked %d users as unreachable.", marked)
+
+    async def poll(self, overlap=60.0):
+        """
+        Return the users marked unreachable by any replica since the previous
+        poll. Each poll looks `overlap` seconds further back than the latest
+        blocked_at it has seen, because blocked_at is the marking
+        transaction's start time and can commit out of order. Some users may
+        be returned twice. The first poll only finds where to start.
+        """
+        since = self._seen_until - timedelta(seconds=overlap) if self._seen_until else None
+        polled = await safe_db_query(lambda db: marked_unreachable_since(db, since))
+        if polled is None:
+            return []
+        marked, latest = polled
+        # Database time, so the replicas' clocks don't matter
+        self._seen_until = max(self._seen_until or datetime.min, latest or datetime(1970, 1, 1))
+        return marked
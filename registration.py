@@ -0,0 +1,117 @@
+# registration.py
+
+import asyncio
+import itertools
+import logging
+import os
+from sqlalchemy import func, literal_column, or_, select
+from batching import BatchWriter
+from database import dialect_insert, engine, safe_db_query
+from logs import events
+from models import User
+from stats import record_signups
+
+logger = logging.getLogger(__name__)
+
+# Write-behind mode groups /start registrations arriving within the window into one upsert
+REGISTRATION_WRITE_BEHIND = os.getenv("REGISTRATION_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+REGISTRATION_BATCH_WINDOW = float(os.getenv("REGISTRATION_BATCH_WINDOW_MS", "5")) / 1000
+REGISTRATION_BATCH_SIZE = int(os.getenv("REGISTRATION_BATCH_SIZE", "500"))
+
+
+def _inserted_flag(db, telegram_user_ids):
+    # Postgres marks freshly inserted rows with xmax = 0
+    if engine.dialect.name == "postgresql":
+        return literal_column("(xmax = 0)").label("inserted")
+    # Elsewhere (SQLite in development) look up which users already exist, in the same transaction
+    existing = db.scalars(select(User.telegram_user_id).where(User.telegram_user_id.in_(telegram_user_ids))).all()
+    return User.telegram_user_id.notin_(existing).label("inserted")
+
+
+def upsert_users(db, rows):
+    """
+    Register users with one INSERT ... ON CONFLICT statement.
+
+    Existing rows are only rewritten when the profile actually changed or the
+    user was marked unreachable (a /start means they can be messaged again),
+    and first_start_param is only set on insert. New users are counted in
+    the referral rollup in the same transaction. Returns the set of
+    telegram_user_ids that were newly inserted.
+    """
+    # ON CONFLICT cannot touch the same row twice in one statement, so keep the latest profile
+    rows = list({row["telegram_user_id"]: row for row in rows}.values())
+
+    stmt = dialect_insert(User).values(rows)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_user_id],
+        set_={
+            "username": excluded.username,
+            "first_name": excluded.first_name,
+            "last_name": excluded.last_name,
+            "updated_at": func.now(),
+            "blocked_at": None,
+        },
+        where=or_(
+            User.blocked_at.isnot(None),
+            User.username.is_distinct_from(excluded.username),
+            User.first_name.is_distinct_from(excluded.first_name),
+            User.last_name.is_distinct_from(excluded.last_name),
+        ),
+    ).returning(
+        User.telegram_user_id,
+        User.first_start_param,
+        User.created_at,
+        _inserted_flag(db, [row["telegram_user_id"] for row in rows]),
+    )
+
+    inserted = [row for row in db.execute(stmt).all() if row.inserted]
+    record_signups(db, [(row.first_start_param, row.created_at) for row in inserted])
+    db.commit()
+    return {row.telegram_user_id for row in inserted}
+
+
+class RegistrationBatcher(BatchWriter):
+    """
+    Collects registrations for `window` seconds (or until `max_batch` rows)
+    and writes them with a single multi-row upsert. With a zero window every
+    registration is flushed on its own.
+    """
+
+    def __init__(self, window=0.0, max_batch=REGISTRATION_BATCH_SIZE):
+        super().__init__(window, max_batch)
+        self._keys = itertools.count()
+
+    @property
+    def write_behind(self):
+        return self.interval > 0
+
+    def submit(self, row):
+        """
+        Queue a user row for registration. Returns a future resolving to True
+        for a new user, False for an existing one and None if the write failed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Every registration has its own future, so repeated users aren't merged here (upsert_users does that)
+        self.put(next(self._keys), (row, future))
+        return future
+
+    async def write(self, batch):
+        rows = [row for row, _ in batch]
+        inserted = await safe_db_query(lambda db: upsert_users(db, rows))
+        if inserted is None:
+            logger.error("Failed to register %d users.", len(rows))
+        else:
+            for row in rows:
+                if row["telegram_user_id"] in inserted:
+                    events.count("user_registered", "New user registered: %s, param=%s",
+                                 row["telegram_user_id"], row["first_start_param"])
+            if len(rows) > 1:
+                logger.debug("Registered batch of %d users (%d new).", len(rows), len(inserted))
+
+        for row, future in batch:
+            if not future.done():
+                future.set_result(None if inserted is None else row["telegram_user_id"] in inserted)
+
+
+registrations = RegistrationBatcher(window=REGISTRATION_BATCH_WINDOW if REGISTRATION_WRITE_BEHIND else 0.0)
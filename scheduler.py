@@ -0,0 +1,150 @@
+# scheduler.py
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from logs import events
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "scheduler_queue_wait_seconds",
+    "Time messages waited before a worker picked them up: in the interactive queue, or as a broadcast recipient.",
+    ["lane"],
+)
+
+
+class PriorityScheduler:
+    """
+    Strict-priority scheduler for outgoing messages.
+
+    Interactive replies are always dequeued before broadcast sends, and
+    `reserved_workers` of the pool never pick up broadcast work, so a large
+    broadcast cannot hold up a welcome message. The interactive queue is
+    bounded: `submit()` waits while it is full, which pushes back on
+    producers.
+
+    Broadcasts are added as jobs rather than one queue item per recipient:
+    the bulk lane takes recipients from the active jobs in turn.
+
+    Sends that still fail after the sender's retries are passed to
+    `on_failure(chat_id, error)`, or logged when no handler is set.
+    """
+
+    def __init__(self, sender, workers=16, reserved_workers=2, interactive_capacity=1000, on_failure=None):
+        self.sender = sender
+        self.on_failure = on_failure
+        self.workers = workers
+        self.reserved_workers = min(reserved_workers, workers - 1)
+        self._queue = asyncio.Queue(interactive_capacity)
+        self._item_queued = asyncio.Condition()
+        self._jobs = deque()
+        self._tasks = []
+
+    def start(self):
+        if self._tasks:
+            return
+        for index in range(self.workers):
+            lanes = (INTERACTIVE,) if index < self.reserved_workers else (INTERACTIVE, BULK)
+            self._tasks.append(asyncio.create_task(self._worker(lanes)))
+        logger.info("Message scheduler started with %d workers (%d interactive-only).", self.workers, self.reserved_workers)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, chat_id, send):
+        """Queue `send()` for `chat_id` as an interactive message, waiting while the queue is at capacity."""
+        await self._queue.put((time.monotonic(), chat_id, send))
+        async with self._item_queued:
+            self._item_queued.notify_all()
+
+    async def add_job(self, job):
+        """Start sending a broadcast job; its recipients may still be loading."""
+        self._jobs.append(job)
+        await self.wake()
+
+    async def wake(self):
+        """Tell idle workers there may be new work, e.g. after a job got more recipients."""
+        self._reap_jobs()
+        async with self._item_queued:
+            self._item_queued.notify_all()
+
+    def remove_job(self, job):
+        """Stop handing out a job's recipients; sends already in flight still finish."""
+        if job in self._jobs:
+            self._jobs.remove(job)
+
+    def _reap_jobs(self):
+        for job in [job for job in self._jobs if job.done]:
+            self._jobs.remove(job)
+            job.finished.set()
+
+    def _next_job_recipient(self):
+        # Round-robin between jobs so one huge broadcast doesn't starve the others
+        for _ in range(len(self._jobs)):
+            job = self._jobs[0]
+            self._jobs.rotate(-1)
+            recipient = job.next_recipient()
+            if recipient is not None:
+                return job, recipient
+        return None, (None, None, None)
+
+    def depth(self, lane):
+        if lane == INTERACTIVE:
+            return self._queue.qsize()
+        return sum(job.pending for job in self._jobs)
+
+    def _next_lane(self, lanes):
+        for lane in lanes:
+            if lane == INTERACTIVE and not self._queue.empty():
+                return lane
+            if lane == BULK and any(job.pending for job in self._jobs):
+                return lane
+        return None
+
+    async def _worker(self, lanes):
+        while True:
+            job = None
+            # Every put wakes the idle workers; each re-checks only the lanes it serves
+            async with self._item_queued:
+                await self._item_queued.wait_for(lambda: self._next_lane(lanes) is not None)
+                lane = self._next_lane(lanes)
+                if lane == BULK:
+                    job, (position, chat_id, enqueued_at) = self._next_job_recipient()
+                    send = lambda job=job, chat_id=chat_id: job.send(chat_id)
+                else:
+                    enqueued_at, chat_id, send = self._queue.get_nowait()
+                QUEUE_WAIT_SECONDS.observe(time.monotonic() - enqueued_at, lane=lane)
+
+            error = None
+            cancelled = False
+            try:
+                await self.sender.send(chat_id, send, urgent=lane == INTERACTIVE)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            except Exception as e:
+                error = e
+                if self.on_failure:
+                    self.on_failure(chat_id, e)
+                else:
+                    events.count("send_failed", "Error sending %s message to %s: %s", lane, chat_id, e, level=logging.ERROR)
+            finally:
+                if job is None:
+                    self._queue.task_done()
+                elif cancelled:
+                    # We don't know whether it went out; leave it unconfirmed so the job's cursor stays before it
+                    job.abandon(position)
+                else:
+                    job.record(position, error, chat_id)
+                    if job.done:
+                        self._reap_jobs()
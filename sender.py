@@ -0,0 +1,163 @@
+# sender.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from logs import events
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Every Bot API attempt by outcome; rate(...{result="ok"}) is the effective send rate
+SEND_ATTEMPTS = Counter("telegram_send_attempts_total", "Bot API send attempts by outcome.", ["result"])
+
+# BadRequest descriptions that mean the chat is gone for good
+UNREACHABLE_BAD_REQUESTS = (
+    "chat not found",
+    "user not found",
+    "user is deactivated",
+    "peer_id_invalid",
+)
+
+
+def is_unreachable(error):
+    """True when `error` means the recipient can no longer receive messages from the bot."""
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        return any(reason in message for reason in UNREACHABLE_BAD_REQUESTS)
+    return False
+
+
+class TokenBucket:
+    """Global send budget: refills `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._urgent_waiters = 0
+
+    def _refill(self, now):
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds`, e.g. after a RetryAfter."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self, urgent=False):
+        """Wait for a token. Urgent callers are served before everyone else."""
+        if urgent:
+            self._urgent_waiters += 1
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._urgent_waiters and not urgent:
+                    delay = 1 / self.rate
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+        finally:
+            if urgent:
+                self._urgent_waiters -= 1
+
+
+class ChatRateLimiter:
+    """Spaces out messages to the same chat by at least `interval` seconds."""
+
+    def __init__(self, interval=1.0, max_chats=100_000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_allowed = OrderedDict()
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._next_allowed.pop(chat_id, 0.0))
+        self._next_allowed[chat_id] = slot + self.interval
+
+        # Entries are kept in reservation order, so expired ones sit at the front
+        while self._next_allowed:
+            oldest_chat, ready_at = next(iter(self._next_allowed.items()))
+            if ready_at > now and len(self._next_allowed) <= self.max_chats:
+                break
+            del self._next_allowed[oldest_chat]
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class RateLimitedSender:
+    """
+    Sends Bot API requests within Telegram's limits. Many sends can wait on
+    it concurrently, so throughput is bound by the rate budget instead of by
+    network round trips.
+    """
+
+    def __init__(self, rate=30, per_chat_interval=1.0, max_attempts=5, min_rate=1.0):
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate)
+        self.chats = ChatRateLimiter(per_chat_interval)
+
+    def set_max_rate(self, rate):
+        """Change the sustained rate, e.g. when the global budget is split between more replicas."""
+        self.max_rate = max(self.min_rate, float(rate))
+        self.bucket.rate = min(self.bucket.rate, self.max_rate)
+        self.bucket.capacity = max(1.0, self.max_rate)
+
+    def _throttle(self, retry_after):
+        self.bucket.pause(retry_after)
+        self.bucket.rate = max(self.min_rate, self.bucket.rate * 0.8)
+        events.count("flood_control", "Flood control hit, pausing sends for %ss at %.1f msgs/s",
+                     retry_after, self.bucket.rate, level=logging.WARNING)
+
+    def _recover(self):
+        if self.bucket.rate < self.max_rate:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + 0.1)
+
+    async def send(self, chat_id, send, urgent=False):
+        """Run `send()` for `chat_id` within the rate limits, retrying RetryAfter and network errors."""
+        for attempt in range(1, self.max_attempts + 1):
+            await self.chats.wait(chat_id)
+            await self.bucket.acquire(urgent)
+            try:
+                result = await send()
+                SEND_ATTEMPTS.inc(result="ok")
+                self._recover()
+                return result
+            except RetryAfter as e:
+                SEND_ATTEMPTS.inc(result="retry_after")
+                self._throttle(e.retry_after)
+                if attempt == self.max_attempts:
+                    raise
+            except Forbidden:
+                SEND_ATTEMPTS.inc(result="forbidden")
+                raise
+            except BadRequest:
+                SEND_ATTEMPTS.inc(result="bad_request")
+                raise
+            except NetworkError as e:
+                SEND_ATTEMPTS.inc(result="network_error")
+                if attempt == self.max_attempts:
+                    raise
+                events.count("send_network_error", "Network error sending to %s on attempt %d: %s", chat_id, attempt, e,
+                             level=logging.WARNING)
+                await asyncio.sleep(min(2 ** attempt, 30))
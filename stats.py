@@ -0,0 +1,50 @@
+# stats.py
+
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from database import dialect_insert
+from models import ReferralDailyStat
+
+NO_REFERRAL = ''
+
+
+def record_signups(db, signups):
+    """
+    Add new users to the referral rollup: `signups` are (first_start_param,
+    created_at) pairs. Runs in the caller's transaction, so the rollup moves
+    together with the users it counts.
+    """
+    counts = Counter((code or NO_REFERRAL, created_at.date()) for code, created_at in signups)
+    if not counts:
+        return
+    # Sorted, so concurrent registrations lock the rollup rows in the same order
+    rows = [{"code": code, "day": day, "users": users} for (code, day), users in sorted(counts.items())]
+    stmt = dialect_insert(ReferralDailyStat).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[ReferralDailyStat.code, ReferralDailyStat.day],
+        set_={"users": ReferralDailyStat.users + stmt.excluded.users},
+    ))
+
+
+def referral_totals(db, days=7, limit=20):
+    """The `limit` referral codes with the most signups over the last `days` days (today included)."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    users = func.sum(ReferralDailyStat.users).label("users")
+    return db.execute(
+        select(ReferralDailyStat.code, users)
+        .where(ReferralDailyStat.day >= since)
+        .group_by(ReferralDailyStat.code)
+        .order_by(users.desc())
+        .limit(limit)
+    ).all()
+
+
+def referral_daily(db, code, days=7):
+    """Signups per day for one referral code over the last `days` days, newest first."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    return db.execute(
+        select(ReferralDailyStat.day, ReferralDailyStat.users)
+        .where(ReferralDailyStat.code == code, ReferralDailyStat.day >= since)
+        .order_by(ReferralDailyStat.day.desc())
+    ).all()
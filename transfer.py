@@ -0,0 +1,163 @@
+# transfer.py
+#
+# Bulk export/import of the users table with PostgreSQL COPY.
+#
+#   python transfer.py export users.csv.gz
+#   python transfer.py import users.csv.gz
+#
+# Files ending in .gz are (de)compressed on the fly; "-" means stdout/stdin.
+
+import argparse
+import gzip
+import logging
+import sys
+from sqlalchemy import text
+from database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Columns of an export, and the columns an import may contain (telegram_user_id is required)
+USER_COLUMNS = (
+    "telegram_user_id",
+    "username",
+    "first_name",
+    "last_name",
+    "first_start_param",
+    "created_at",
+    "updated_at",
+    "blocked_at",
+)
+
+
+def open_dump(path, mode):
+    """Open a CSV dump in text mode: gzip by extension, "-" for stdin/stdout."""
+    if path == "-":
+        return sys.stdout if mode == "w" else sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _copy_cursor(db):
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Bulk export and import use COPY and need PostgreSQL")
+    # The session's own connection, so COPY runs inside its transaction
+    return db.connection().connection.cursor()
+
+
+def export_users(db, dump):
+    """
+    Write every user to the text file `dump` as CSV with a header row.
+    COPY streams the rows to the file as the server produces them, so memory
+    use stays flat at any table size. Returns the number of rows written.
+    """
+    with _copy_cursor(db) as cursor:
+        cursor.copy_expert(
+            f"COPY (SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)",
+            dump,
+        )
+        exported = cursor.rowcount
+    db.commit()
+    return exported
+
+
+def _merge_statement(columns):
+    # Only the columns present in the file are overwritten; an older row in the file never wins
+    updates = [f"{column} = EXCLUDED.{column}" for column in ("username", "first_name", "last_name", "blocked_at")
+               if column in columns]
+    updates += [
+        "first_start_param = COALESCE(users.first_start_param, EXCLUDED.first_start_param)",
+        "created_at = LEAST(users.created_at, EXCLUDED.created_at)",
+        "updated_at = EXCLUDED.updated_at",
+    ]
+    # The rollup counts every user under (first_start_param, day of created_at), and a merge can change both for an
+    # existing user: the CTEs share one snapshot, so `previous` still sees the rows as they were before `merged`
+    return f"""
+        WITH previous AS (
+            SELECT telegram_user_id, first_start_param, created_at
+            FROM users
+            WHERE telegram_user_id IN (SELECT telegram_user_id FROM users_import)
+        ), merged AS (
+            INSERT INTO users ({', '.join(USER_COLUMNS)})
+            SELECT DISTINCT ON (telegram_user_id)
+                telegram_user_id, username, first_name, last_name, first_start_param,
+                COALESCE(created_at, now()), COALESCE(updated_at, now()), blocked_at
+            FROM users_import
+            WHERE telegram_user_id IS NOT NULL
+            ORDER BY telegram_user_id, updated_at DESC NULLS LAST
+            ON CONFLICT (telegram_user_id) DO UPDATE SET {', '.join(updates)}
+            WHERE EXCLUDED.updated_at > users.updated_at
+            RETURNING telegram_user_id, first_start_param, created_at, (xmax = 0) AS inserted
+        ), moved AS (
+            SELECT COALESCE(first_start_param, '') AS code, CAST(created_at AS DATE) AS day, 1 AS users
+            FROM merged
+            -- An update of a user a concurrent /start inserted (and counted) after our snapshot isn't counted again
+            WHERE inserted OR telegram_user_id IN (SELECT telegram_user_id FROM previous)
+            UNION ALL
+            SELECT COALESCE(previous.first_start_param, ''), CAST(previous.created_at AS DATE), -1
+            FROM merged JOIN previous USING (telegram_user_id)
+        ), rollup AS (
+            INSERT INTO referral_daily_stats (code, day, users)
+            SELECT code, day, SUM(users)
+            FROM moved
+            GROUP BY code, day
+            HAVING SUM(users) <> 0
+            ON CONFLICT (code, day) DO UPDATE SET users = referral_daily_stats.users + EXCLUDED.users
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted) AS inserted, COUNT(*) FILTER (WHERE NOT inserted) AS updated
+        FROM merged
+    """
+
+
+def import_users(db, dump):
+    """
+    Merge the users in the CSV file `dump` into the users table.
+
+    The file needs a header row naming any of USER_COLUMNS, telegram_user_id
+    included. Rows are COPYed into a temporary staging table and merged with
+    one INSERT ... ON CONFLICT on telegram_user_id. The referral rollup is
+    updated in the same statement: new users are counted, and an updated
+    user whose code or signup day changed is moved to its new row. Returns
+    (rows read, inserted, updated).
+    """
+    header = dump.readline().strip()
+    columns = [column.strip().strip('"') for column in header.split(",")]
+    unknown = set(columns) - set(USER_COLUMNS)
+    if unknown or "telegram_user_id" not in columns:
+        raise ValueError(f"CSV header must name telegram_user_id and only columns from {USER_COLUMNS}: {header!r}")
+
+    db.execute(text(
+        "CREATE TEMPORARY TABLE users_import ("
+        "telegram_user_id BIGINT, username TEXT, first_name TEXT, last_name TEXT, first_start_param TEXT, "
+        "created_at TIMESTAMP, updated_at TIMESTAMP, blocked_at TIMESTAMP"
+        ") ON COMMIT DROP"
+    ))
+    with _copy_cursor(db) as cursor:
+        cursor.copy_expert(f"COPY users_import ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", dump)
+        read = cursor.rowcount
+
+    merged = db.execute(text(_merge_statement(columns))).one()
+    db.commit()
+    return read, merged.inserted, merged.updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the users table as CSV.")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("path", help='CSV file, .gz for gzip, "-" for stdout/stdin')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", stream=sys.stderr)
+
+    with SessionLocal() as db:
+        if args.action == "export":
+            with open_dump(args.path, "w") as dump:
+                exported = export_users(db, dump)
+            logger.info("Exported %d users to %s.", exported, args.path)
+        else:
+            with open_dump(args.path, "r") as dump:
+                read, inserted, updated = import_users(db, dump)
+            logger.info("Imported %s: %d rows, %d new users, %d updated.", args.path, read, inserted, updated)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# transport.py
+
+import httpx
+from telegram.request import HTTPXRequest
+
+
+class KeepAliveHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest that keeps idle connections open for `keepalive_expiry`
+    seconds instead of httpx's default 5, so a pool that goes quiet between
+    bursts (e.g. broadcast batches) doesn't have to reconnect every time.
+    """
+
+    def __init__(self, connection_pool_size=1, keepalive_expiry=60.0, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client = self._build_client()